@@ -6,12 +6,28 @@
 	This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License. To view a copy of this license, visit http://creativecommons.org/licenses/by-sa/4.0/ or send a letter to Creative Commons, PO Box 1866, Mountain View, CA 94042, USA.
 """
 
+import concurrent.futures as cf
+import copy
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
-import numpy.ma as ma
 
 from common import *
 from fe1data import *
 
+# Everything needed to resume a BattleScriptEmu, apart from what it was constructed with. sprites holds SpriteData copies that must not be modified.
+BattleEmuState = namedtuple("BattleEmuState", "total_frames done script_pos wait_for_mov script_op_seq script_op_pos counter frame_ctrs sprites bg_tiles view_offs palette")
+
+def _union_rects(rects):
+	"""Bounding ((top, left), (bottom, right)) of all non-None rects, or None."""
+	rects = [rect for rect in rects if rect is not None]
+	if not rects:
+		return None
+
+	rects = np.array(rects)
+
+	return np.array((rects[:, 0].min(0), rects[:, 1].max(0)), dtype = int)
+
 class BattleScriptEmu:
 	img_tiles = np.array((32, 20), dtype = int)
 	img_size = img_tiles * 8
@@ -22,7 +38,7 @@ class BattleScriptEmu:
 			self.sprite_key = None
 			self.active = False
 
-			self.chr_bank = None
+			self.chr_bank = self.chr_atlas = None
 			self.frame_idx = 0
 			self.aux_sprites = []
 
@@ -32,13 +48,24 @@ class BattleScriptEmu:
 			self.inner_attrs = self.remove_attrs = self.outer_attrs = 0
 			self.rev_facing = False
 
-			self.mov_iter = self.path_iter = None
+			# Movement script and the path script it's currently running, with the position in each. None when not moving.
+			self.mov_script = self.path_script = None
+			self.mov_pos = self.path_pos = 0
 			self.rev_mov_dir = False
 
 			self.pause_anim = True
 			self.anim_script = self.anim_frame_cnts = None
 			self.anim_script_pos = self.anim_frames_left = 0
 
+		def copy(self):
+			# Scripts and chr banks are never modified, so they're shared
+			sprite = copy.copy(self)
+			sprite.aux_sprites = self.aux_sprites.copy()
+			sprite.pos = self.pos.copy()
+			sprite.pos_offs = self.pos_offs.copy()
+
+			return sprite
+
 	def __init__(
 		self, 
 		data, 
@@ -48,12 +75,10 @@ class BattleScriptEmu:
 		init_frame_idx, 
 		miss = False, 
 		*, 
-		chr_banks = None, 
 		bg_msprites = None, 
 		msprites = None,
 	):
 		self._data = data
-		self._chr_banks = chr_banks or {}
 		self._bg_msprites = bg_msprites or {}
 		self._msprites = msprites or {}
 
@@ -72,13 +97,31 @@ class BattleScriptEmu:
 		self._view_offs = np.zeros((2,), dtype = int)
 		self._frame_bg = np.zeros(self.img_size[::-1], dtype = np.uint8)
 		self._frame_img = np.zeros(self.img_size[::-1], dtype = np.uint8)
+		self._shifted_img = np.zeros(self.img_size[::-1], dtype = np.uint8)
+
+		# Read-only views handed out by get_frame
+		self._frame_view = self._frame_img.view()
+		self._frame_view.flags.writeable = False
+		self._shifted_view = self._shifted_img.view()
+		self._shifted_view.flags.writeable = False
+
+		# What's currently rasterized in _frame_bg and _frame_img, so only changes get redrawn. -1 forces the first full rasterization.
+		self._drawn_bg_tiles = np.full(self._bg_tiles.shape, -1, dtype = int)
+		self._drawn_bg_banks = (None, None)
+		self._sprite_rects = []
+		self._frame_view_offs = None
+
+		# ((top, left), (bottom, right)) bounds of the pixels in the last get_frame image that may differ from the previous one, or None. Palette changes aren't included.
+		self.dirty_rect = None
 
 		self._script_idx = script_idx
 		self._script = data.battle_scripts[script_idx]
 		self._script_pos = 0
 		self._wait_for_mov = False
 
-		self._script_op_iter = None
+		# Sequence the current op steps through over multiple frames, and the position in it
+		self._script_op_seq = None
+		self._script_op_pos = 0
 
 		self._frame_ctrs = {}
 		self._counter = 0
@@ -93,10 +136,8 @@ class BattleScriptEmu:
 		).reshape((2, -1, 4))
 
 		chr_bank_idx = data.unit_bsprite_chr_banks[self._unit_idx]
-		chr_bank = self._chr_banks.get(chr_bank_idx)
-		if not chr_banks:
-			chr_bank = data.get_chr_bank_array(chr_bank_idx)
-			self._chr_banks[chr_bank_idx] = chr_bank
+		chr_bank = data.get_chr_bank_array(chr_bank_idx)
+		chr_atlas = data.get_chr_bank_atlas(chr_bank_idx)
 
 		init_x_offs = 0x38 + (unit == UnitTypes.DragonKnight) * 8
 		for idx, sprite in enumerate(self._sprites[:2]):
@@ -109,6 +150,7 @@ class BattleScriptEmu:
 			sprite.active = True
 
 			sprite.chr_bank = chr_bank
+			sprite.chr_atlas = chr_atlas
 			sprite.frame_idx = init_frame_idx
 
 			sign = -1 if idx else 1
@@ -147,10 +189,165 @@ class BattleScriptEmu:
 
 		return self.total_frames - start_frames
 
+	def next_event(self):
+		"""Returns the frame of the next update that can change anything besides timers, or None if the script is done or nothing will ever change."""
+		idle_frames = self._get_idle_frames()
+		if self.done or idle_frames is None:
+			return None
+
+		return self.total_frames + idle_frames
+
+	def advance_to(self, frame):
+		"""Updates until total_frames reaches frame or the script ends, jumping over idle stretches rather than emulating them a frame at a time. Returns the number of frames advanced."""
+		start_frames = self.total_frames
+
+		while self.total_frames < frame and not self.done:
+			idle_frames = self._get_idle_frames()
+			if idle_frames == 0:
+				self.update()
+			else:
+				num_frames = frame - self.total_frames
+				self._skip_frames(min(idle_frames, num_frames) if idle_frames is not None else num_frames)
+
+		self.redraw = self._redraw_bg or self._redraw_sprites
+
+		return self.total_frames - start_frames
+
+	def snapshot(self):
+		"""Returns a BattleEmuState of the current state, which restore can return to any number of times."""
+		return BattleEmuState(
+			self.total_frames,
+			self.done,
+			self._script_pos,
+			self._wait_for_mov,
+			self._script_op_seq,
+			self._script_op_pos,
+			self._counter,
+			tuple(self._frame_ctrs.items()),
+			tuple(sprite.copy() for sprite in self._sprites),
+			self._bg_tiles.copy(),
+			tuple(self._view_offs),
+			self._palette.copy(),
+		)
+
+	def restore(self, state):
+		"""Returns to a state from snapshot. The state must come from an emulator constructed with the same team, unit and script."""
+		self.total_frames = state.total_frames
+		self.done = state.done
+		self._script_pos = state.script_pos
+		self._wait_for_mov = state.wait_for_mov
+		self._script_op_seq = state.script_op_seq
+		self._script_op_pos = state.script_op_pos
+		self._counter = state.counter
+		self._frame_ctrs = dict(state.frame_ctrs)
+
+		self._sprites = [sprite.copy() for sprite in state.sprites]
+		self._sprite = self._sprites[self._team_idx]
+		self._proj_sprite = self._sprites[2]
+
+		self._bg_tiles[:, :] = state.bg_tiles
+		self._view_offs[:] = state.view_offs
+		self._palette[:] = state.palette
+
+		# Nothing rendered can be trusted, so the next frame is drawn from scratch
+		self._drawn_bg_tiles[:, :] = -1
+		self._drawn_bg_banks = (None, None)
+		self._sprite_rects = []
+		self._frame_view_offs = None
+
+		self.redraw = self._redraw_bg = self._redraw_sprites = True
+
+		return
+
+	def fork(self, *, miss = None):
+		"""Returns a new emulator continuing from the current state, sharing metasprite caches. miss can be changed only as long as the script hasn't yet waited for the projectile to finish, e.g. to run the hit and miss variants of a script from a common prefix."""
+		emu = BattleScriptEmu(
+			self._data,
+			self._team_idx,
+			self._unit,
+			self._script_idx,
+			self._init_frame_idx,
+			self._miss if miss is None else miss,
+			bg_msprites = self._bg_msprites,
+			msprites = self._msprites,
+		)
+		emu.restore(self.snapshot())
+
+		return emu
+
+	def _get_idle_frames(self):
+		# Number of coming frames whose updates would only count down timers, or None if unlimited
+		idle_frames = None
+		for sprite in self._sprites:
+			if not sprite.active:
+				continue
+
+			if sprite.mov_script is not None:
+				return 0
+
+			if not sprite.pause_anim:
+				# The animation steps when anim_frames_left reaches 0
+				sprite_frames = max(sprite.anim_frames_left - 1, 0)
+				idle_frames = min(idle_frames, sprite_frames) if idle_frames is not None else sprite_frames
+
+		if not self._wait_for_mov:
+			if self._script_pos >= len(self._script):
+				return 0
+
+			op = self._script[self._script_pos]
+			idle_hdlr = self._idle_hdlrs.get(op.opcode)
+			op_frames = idle_hdlr(self, op) if idle_hdlr else 0
+			if op_frames is not None:
+				idle_frames = min(idle_frames, op_frames) if idle_frames is not None else op_frames
+
+		return idle_frames
+
+	def _skip_frames(self, num_frames):
+		# Applies num_frames idle updates at once. Must not exceed _get_idle_frames.
+		if not self._wait_for_mov:
+			op = self._script[self._script_pos]
+			if op.opcode == BScriptOps.WaitForCondition and op.param & 0x80:
+				self._counter = (self._counter - num_frames) & 0xff
+
+		for ctr, value in self._frame_ctrs.items():
+			self._frame_ctrs[ctr] = max(value - num_frames, 0)
+
+		self.total_frames += num_frames
+
+		for sprite in self._sprites:
+			if sprite.active and not sprite.pause_anim:
+				sprite.anim_frames_left -= num_frames
+
+		return
+
 	def get_frame(self):
+		"""Returns (image, palette) for the current frame. Both are views of the emulator's own buffers, only valid until the next update, so copy them to keep them."""
 		self._render()
 
-		return np.roll(self._frame_img, self._view_offs, (0, 1)), self._palette
+		# The view offset moves everything
+		view_offs = tuple(self._view_offs)
+		if view_offs != self._frame_view_offs or (any(view_offs) and self.dirty_rect is not None):
+			self.dirty_rect = np.array(((0, 0), self._frame_img.shape), dtype = int)
+
+		self._frame_view_offs = view_offs
+
+		if not any(view_offs):
+			return self._frame_view, self._palette
+
+		# Same as np.roll, but into a persistent buffer
+		height, width = self._frame_img.shape
+		offs_y, offs_x = view_offs[0] % height, view_offs[1] % width
+		for tgt_y, src_y in (
+			(slice(offs_y, None), slice(None, height - offs_y)),
+			(slice(None, offs_y), slice(height - offs_y, None)),
+		):
+			for tgt_x, src_x in (
+				(slice(offs_x, None), slice(None, width - offs_x)),
+				(slice(None, offs_x), slice(width - offs_x, None)),
+			):
+				self._shifted_img[tgt_y, tgt_x] = self._frame_img[src_y, src_x]
+
+		return self._shifted_view, self._palette
 
 	def _update_script(self):
 		if self._wait_for_mov:
@@ -169,17 +366,18 @@ class BattleScriptEmu:
 		return True
 
 	def _update_pos(self, sprite):
-		if not sprite.mov_iter:
+		if sprite.mov_script is None:
 			return
 
 		done = False
 		while not done:
-			if sprite.path_iter:
-				try:
-					offs = next(sprite.path_iter)
-				except StopIteration:
-					sprite.path_iter = None
+			if sprite.path_script is not None:
+				if sprite.path_pos >= len(sprite.path_script):
+					sprite.path_script = None
 				else:
+					offs = sprite.path_script[sprite.path_pos]
+					sprite.path_pos += 1
+
 					sign = -1 if sprite.rev_mov_dir ^ sprite.team_idx else 1
 					offs = (offs.y, offs.x * sign)
 					if any(offs):
@@ -188,13 +386,15 @@ class BattleScriptEmu:
 
 					done = True
 
-			if not sprite.path_iter:
-				try:
-					path_idx = next(sprite.mov_iter)
-					sprite.path_iter = iter(self._data.bpath_scripts[path_idx])
+			if sprite.path_script is None:
+				if sprite.mov_pos < len(sprite.mov_script):
+					path_idx = sprite.mov_script[sprite.mov_pos]
+					sprite.mov_pos += 1
+					sprite.path_script = self._data.bpath_scripts[path_idx]
+					sprite.path_pos = 0
 
-				except StopIteration:
-					sprite.mov_iter = sprite.path_iter = None
+				else:
+					sprite.mov_script = sprite.path_script = None
 					self._wait_for_mov = False
 
 					done = True
@@ -245,6 +445,7 @@ class BattleScriptEmu:
 		return
 
 	def _render(self):
+		self.dirty_rect = None
 		self.redraw = self._redraw_bg or self._redraw_sprites
 		if not self.redraw:
 			return
@@ -256,6 +457,7 @@ class BattleScriptEmu:
 		bank_unit_idx = self._unit_idx - base_idx
 
 		# Background pass
+		bg_rect = None
 		if self._redraw_bg:
 			for sprite in reversed(self._sprites):
 				if not sprite.active or not sprite.bg_sprite:
@@ -278,35 +480,30 @@ class BattleScriptEmu:
 				data.draw_bg_sprite_chrs(
 					self._bg_tiles, msprite, *tile_pos[::-1])
 
-			width = self._frame_img.shape[1]
-			half_width = width // 2
-			for sprite_idx, start_x, end_x in (
-				(0, half_width, width),
-				(1, 0, half_width),
-			):
-				start_row = start_x // 8
-				end_row = end_x // 8
-				chr_bank = self._sprites[sprite_idx].chr_bank
-				bg_tiles = self._bg_tiles[:, start_row:end_row]
-				self._frame_bg[:, start_x:end_x] = (chr_bank[bg_tiles]
-					.transpose(0, 2, 1, 3).reshape((-1, half_width)).filled())
-				
-			self._frame_bg += (self._bg_attrs * 4).repeat(16, 0).repeat(16, 1)
+			bg_rect = self._rasterize_bg()
 
 			self._redraw_bg = False
 
-		# Sprite pass
-		self._frame_img[:, :] = self._frame_bg
+		# Sprite pass. Restore the background under the old sprites and the changed bg cells, then draw all sprites over it.
+		restore_rect = _union_rects([bg_rect] + self._sprite_rects)
+		if restore_rect is not None:
+			(top, left), (bottom, right) = restore_rect
+			self._frame_img[top:bottom, left:right] = self._frame_bg[top:bottom, left:right]
 
+		sprite_rects = []
 		for sprite in self._sprites:
 			if not sprite.active or sprite.bg_sprite:
 				continue
 
-			self._draw_sprite(
-				sprite, bank_idx, bank_unit_idx, sprite.frame_idx)
+			sprite_rects.append(self._draw_sprite(
+				sprite, bank_idx, bank_unit_idx, sprite.frame_idx))
 
 			for frame_idx in sprite.aux_sprites:
-				self._draw_sprite(sprite, bank_idx, bank_unit_idx, frame_idx)
+				sprite_rects.append(self._draw_sprite(
+					sprite, bank_idx, bank_unit_idx, frame_idx))
+
+		self._sprite_rects = sprite_rects
+		self.dirty_rect = _union_rects([restore_rect] + sprite_rects)
 
 		self._redraw_sprites = False
 		self.redraw = False
@@ -315,6 +512,35 @@ class BattleScriptEmu:
 
 		return
 
+	def _rasterize_bg(self):
+		# The left half of the screen uses the chr bank of the sprite on the left (team 1), the right half the other
+		banks = (self._sprites[1].chr_bank, self._sprites[0].chr_bank)
+		dirty = self._bg_tiles != self._drawn_bg_tiles
+		if any(bank is not drawn_bank for bank, drawn_bank in zip(banks, self._drawn_bg_banks)):
+			dirty[:, :] = True
+
+		rows, cols = np.nonzero(dirty)
+		if not len(rows):
+			return None
+
+		height, width = self._bg_tiles.shape
+		tiles = self._bg_tiles[rows, cols]
+		pixels = np.where(
+			(cols < width // 2)[:, np.newaxis, np.newaxis], 
+			banks[0][tiles], 
+			banks[1][tiles],
+		)
+		pixels += (self._bg_attrs[rows // 2, cols // 2] * 4)[:, np.newaxis, np.newaxis]
+
+		self._frame_bg.reshape((height, 8, width, 8))[rows, :, cols, :] = pixels
+		self._drawn_bg_tiles[rows, cols] = tiles
+		self._drawn_bg_banks = banks
+
+		return np.array((
+			(rows.min() * 8, cols.min() * 8),
+			((rows.max() + 1) * 8, (cols.max() + 1) * 8),
+		), dtype = int)
+
 	def _draw_sprite(self, sprite, bank_idx, bank_unit_idx, frame_idx):
 		data = self._data
 		rom = data._rom
@@ -322,32 +548,41 @@ class BattleScriptEmu:
 
 		hflipped = sprite.rev_facing ^ sprite.team_idx
 
-		key = (sprite.sprite_key, frame_idx, sprite.inner_attrs, 
-			sprite.remove_attrs, sprite.outer_attrs)
+		# Same attribute math as draw_sprite_type2. Only the non-palette bits need a redraw, palette variants are remapped from that.
+		clear_bits = sprite.remove_attrs
+		set_bits = sprite.outer_attrs | (sprite.inner_attrs & ~clear_bits)
+		# The chr bank is part of the key since the projectile sprite is drawn from different banks under the same sprite key
+		key = (sprite.sprite_key, sprite.chr_bank.ctypes.data, frame_idx, clear_bits, set_bits)
 		sprite_info = self._msprites.get(key)
 		if sprite_info:
 			msprite, offs = sprite_info
 		else:
-			frame_addrs = (data.unit_bsprite_frame_addrs
-				  [bank_idx][bank_unit_idx])
-			frame_addr = frame_addrs[frame_idx]
-			msprite = data._load_metasprite_type2(leca(frame_addr))
-
-			bounds = data.get_sprite_type2_bounds(msprite)
-			size = bounds[1] - bounds[0]
-			bitmap = ma.masked_all(size, dtype = np.uint8)
-			data.draw_sprite_type2(
-				bitmap, 
-				sprite.chr_bank, 
-				msprite, 
-				*-bounds[0][::-1],
-				hi_pal = True,
-				pre_set_bits = sprite.inner_attrs,
-				clear_bits = sprite.remove_attrs,
-				post_set_bits = sprite.outer_attrs,
-			)
-
-			msprite, offs = self._msprites[key] = (bitmap, bounds[0])
+			base_key = (*key[:3], clear_bits & ~3, set_bits & ~3)
+			base_info = self._msprites.get(base_key)
+			if not base_info:
+				frame_addrs = (data.unit_bsprite_frame_addrs
+					  [bank_idx][bank_unit_idx])
+				frame_addr = frame_addrs[frame_idx]
+				msprite = data._load_metasprite_type2(leca(frame_addr))
+
+				bounds = data.get_sprite_type2_bounds(msprite)
+				size = bounds[1] - bounds[0]
+				bitmap = new_bitmap(size)
+				data.draw_sprite_type2(
+					bitmap, 
+					sprite.chr_atlas, 
+					msprite, 
+					*-bounds[0][::-1],
+					hi_pal = True,
+					clear_bits = base_key[3],
+					post_set_bits = base_key[4],
+				)
+
+				base_info = self._msprites[base_key] = (bitmap, bounds[0])
+
+			bitmap, offs = base_info
+			msprite, offs = self._msprites[key] = (
+				remap_palette(bitmap, clear_bits, set_bits), offs)
 
 		if hflipped:
 			msprite = msprite[:, ::-1]
@@ -359,9 +594,9 @@ class BattleScriptEmu:
 
 		pos = sprite.pos + sprite.pos_offs + offs
 		bound = pos + msprite.shape
-		mask = ~msprite.mask
-		tgt = self._frame_img[pos[0]:bound[0], pos[1]:bound[1]]
-		tgt[mask] = msprite[mask]
+		blit_bitmap(self._frame_img[pos[0]:bound[0], pos[1]:bound[1]], msprite)
+
+		return np.clip((pos, bound), 0, self._frame_img.shape)
 
 	def _init_projectile(self, proj_idx):
 		data = self._data
@@ -378,8 +613,8 @@ class BattleScriptEmu:
 		proj.remove_attrs = 3
 		proj.outer_attrs = sprite.team_idx
 
-		proj.mov_iter = iter(
-			data.bmov_scripts[data.battle_proj_data[proj_idx][1]])
+		proj.mov_script = data.bmov_scripts[data.battle_proj_data[proj_idx][1]]
+		proj.mov_pos = 0
 		proj.rev_facing = proj.rev_mov_dir = False
 
 	def _set_sprite_redraw(self, sprite):
@@ -388,6 +623,16 @@ class BattleScriptEmu:
 		else:
 			self._redraw_sprites = True
 
+	def _next_script_op_value(self):
+		# Steps through _script_op_seq, raising StopIteration at the end like next
+		if self._script_op_pos >= len(self._script_op_seq):
+			raise StopIteration()
+
+		value = self._script_op_seq[self._script_op_pos]
+		self._script_op_pos += 1
+
+		return value
+
 	def _nop_hdlr(self, op):
 		return
 
@@ -399,8 +644,9 @@ class BattleScriptEmu:
 		sprite = self._sprite
 
 		sprite.rev_mov_dir = bool(param & 0x40)
-		sprite.mov_iter = iter(self._data.bmov_scripts[param & 0x3f])
-		sprite.path_iter = None
+		sprite.mov_script = self._data.bmov_scripts[param & 0x3f]
+		sprite.mov_pos = 0
+		sprite.path_script = None
 		
 		self._wait_for_mov = not (param & 0x80)
 
@@ -412,6 +658,7 @@ class BattleScriptEmu:
 		self._init_projectile(op.param)
 
 		proj.chr_bank = self._sprite.chr_bank
+		proj.chr_atlas = self._sprite.chr_atlas
 		proj.frame_idx = 1
 		proj.anim_script = data.banim_scripts[anim_idx]
 		proj.anim_frame_cnts = data.banim_script_frame_cnts[anim_idx]
@@ -435,6 +682,13 @@ class BattleScriptEmu:
 			
 		return wait
 
+	def _wait_for_cond_idle(self, op):
+		if op.param & 0x80:
+			return (self._counter - 1) & 0xff
+
+		# Only an animation step can change the frame
+		return None if self._sprite.frame_idx != op.param else 0
+
 	def _set_layers_hdlr(self, op):
 		bg = bool(op.param & 2)
 		sprite = self._sprite
@@ -478,7 +732,7 @@ class BattleScriptEmu:
 		data = self._data
 		team_idx = int(not self._team_idx)
 
-		if not self._script_op_iter:
+		if self._script_op_seq is None:
 			wait_frames = self._frame_ctrs.get("death")
 			if wait_frames is None:
 				self._frame_ctrs["death"] = 0x20
@@ -493,13 +747,14 @@ class BattleScriptEmu:
 			else:
 				pal_idcs = data.battle_team_death_pal_idcs 
 
-			self._script_op_iter = iter(pal_idcs[team_idx])
+			self._script_op_seq = pal_idcs[team_idx]
+			self._script_op_pos = 0
 
 		elif self._frame_ctrs["death"]:
 			return True
 
 		try:
-			pal_idx = next(self._script_op_iter)
+			pal_idx = self._next_script_op_value()
 			self._palette[:, team_idx, :] = data.battle_pal_rows[pal_idx]
 			self._frame_ctrs["death"] = 8
 
@@ -512,18 +767,23 @@ class BattleScriptEmu:
 
 			return
 
+	def _show_hp_idle(self, op):
+		# Waits while the death counter runs down
+		return self._frame_ctrs.get("death") or 0
+
 	def _hit_effect_hdlr(self, op):
 		data = self._data
 		tgt_team_idx = int(not self._team_idx)
-		if not self._script_op_iter:
-			self._script_op_iter = iter(data.battle_hit_shake_offs)
+		if self._script_op_seq is None:
+			self._script_op_seq = data.battle_hit_shake_offs
+			self._script_op_pos = 0
 
 			pal_idx = data.battle_team_hit_pal_idcs[tgt_team_idx]
 			self._palette[:, tgt_team_idx, :] = data.battle_pal_rows[pal_idx]
 
-		offs = self._view_offs[1] = next(self._script_op_iter)
+		offs = self._view_offs[1] = self._next_script_op_value()
 		if not offs:
-			self._script_op_iter = None
+			self._script_op_seq = None
 
 			# Not implemented: Mamkute palettes
 			pal_idx = (data.battle_team_unit_pal_idcs
@@ -563,6 +823,7 @@ class BattleScriptEmu:
 			proj.pos[0] = 0x62
 
 		proj.chr_bank = self._sprite.chr_bank
+		proj.chr_atlas = self._sprite.chr_atlas
 		proj.frame_idx = self._data.battle_proj_data[op.param][0]
 		proj.pause_anim = True
 
@@ -573,40 +834,42 @@ class BattleScriptEmu:
 	def _wait_for_proj_finish_hdlr(self, op):
 		# Missing is not fully implemented
 		proj = self._proj_sprite
-		if self._miss and proj.mov_iter:
+		if self._miss and proj.mov_script is not None:
 			return True
 
-		proj.mov_iter = proj.path_iter = None
+		proj.mov_script = proj.path_script = None
 		proj.active = False
 
-	def _wait_for_proj_hit_hdlr(self, op):
+	def _is_proj_hit(self):
 		proj = self._proj_sprite
 		sprite = self._sprites[not self._team_idx]
 		if self._team_idx:
-			hit = proj.pos[1] + 16 >= sprite.pos[1]
+			return proj.pos[1] + 16 >= sprite.pos[1]
 		else:
-			hit = proj.pos[1] - 16 < sprite.pos[1]
+			return proj.pos[1] - 16 < sprite.pos[1]
 
-		return not hit
+	def _wait_for_proj_hit_hdlr(self, op):
+		return not self._is_proj_hit()
+
+	def _wait_for_proj_hit_idle(self, op):
+		# The projectile can only hit if something moves
+		return 0 if self._is_proj_hit() else None
 
 	def _wait_for_proj_stop_hdlr(self, op):
-		return self._proj_sprite.mov_iter
+		return self._proj_sprite.mov_script is not None
 
 	def _spawn_unit_proj_hdlr(self, op):
 		data = self._data
 		proj = self._proj_sprite
 		sprite = self._sprite
 
-		chr_bank_idx = data.unit_battle_proj_chr_bank
-		proj.chr_bank = self._chr_banks.get(chr_bank_idx)
-		if proj.chr_bank is None:
-			proj.chr_bank = data.get_chr_bank_array(chr_bank_idx)
-			self._chr_banks[chr_bank_idx] = proj.chr_bank
+		proj.chr_bank = data.get_chr_bank_array(data.unit_battle_proj_chr_bank)
+		proj.chr_atlas = data.get_chr_bank_atlas(data.unit_battle_proj_chr_bank)
 
 		self._init_projectile(op.param)
 
 		proj.pos[0] += data.unit_battle_proj_y_offs[self._unit_idx]
-		proj.mov_iter = iter(data.bmov_scripts[data.unit_proj_bmov_script_idx])
+		proj.mov_script = data.bmov_scripts[data.unit_proj_bmov_script_idx]
 		proj.frame_idx = data.unit_battle_proj_frame_idcs[self._unit_idx]
 		proj.pause_anim = True
 		proj.active = True
@@ -673,6 +936,13 @@ BattleScriptEmu._hdlrs = {
 	BScriptOps.ShowFlockAnim: BattleScriptEmu._flock_anim_hdlr,
 }
 
+# Ops that can wait without changing anything but timers, returning how many frames they will (None if unlimited). All others are assumed to do something every frame.
+BattleScriptEmu._idle_hdlrs = {
+	BScriptOps.WaitForCondition: BattleScriptEmu._wait_for_cond_idle,
+	BScriptOps.ShowHpBar: BattleScriptEmu._show_hp_idle,
+	BScriptOps.WaitForProjHit: BattleScriptEmu._wait_for_proj_hit_idle,
+}
+
 _op_fmts = {
 	BScriptOps.SpawnAnimProjectile: "Spawn ANIMATED PROJECTILE {p:x} from active sprite",
 	BScriptOps.SetCounter: "Set COUNTER to {p:x}",
@@ -707,6 +977,804 @@ _op_fmts.update({
 	BScriptOps.SpriteAttributes: lambda o, p: f"Set SPRITE ATTRIBS {p:x}: {'behind' if p & 0x20 else 'in front of'} background",
 })
 
+# A battle animation to render: the BattleScriptEmu arguments
+BattleAnimJob = namedtuple("BattleAnimJob", "unit script_idx init_frame_idx team_idx miss", defaults = (1, False))
+
+def iter_battle_anim(data, job, *, tgt_fps = 20, bg_msprites = None, msprites = None):
+	"""Runs a BattleAnimJob's script to the end, sampling it at tgt_fps. Yields (image, flat palette, frame time) as each frame is sampled: views of the emulator's buffers, only valid until the next frame is taken, so copy what's kept, and the number of 60 Hz frames since the previous one."""
+	prev_tgt_frame = -1
+	src_mspf = 1000 / 60
+	tgt_mspf = 1000 / tgt_fps
+	mspf_ratio = src_mspf / tgt_mspf
+	emu = BattleScriptEmu(
+		data, 
+		job.team_idx, 
+		job.unit, 
+		job.script_idx, 
+		job.init_frame_idx, 
+		job.miss,
+		bg_msprites = bg_msprites,
+		msprites = msprites,
+	)
+	tgt_frame = 0
+	while True:
+		# Fast-forward straight to the source frame for the next output frame
+		emu.advance_to(int(round(tgt_frame / mspf_ratio)))
+		if emu.done:
+			break
+
+		if int(round(emu.total_frames * mspf_ratio)) == tgt_frame:
+			elapsed_ms = ((tgt_frame - prev_tgt_frame) * tgt_mspf) if prev_tgt_frame >= 0 else 0
+
+			frame_img, frame_pal = emu.get_frame()
+			yield frame_img, frame_pal.reshape(-1), elapsed_ms / src_mspf
+
+			prev_tgt_frame = tgt_frame
+
+		tgt_frame += 1
+
+	return
+
+# Per worker process state for render_battle_anims: (data, CHR shared memory, {unit: (bg_msprites, msprites)})
+_worker_state = None
+
+def _init_battle_anim_worker(rom_path, cache_dir, chr_shm_name, chr_shape, chr_dtype):
+	global _worker_state
+
+	# Every worker maps the same ROM file and views the parent's decoded CHR tiles rather than decoding its own
+	chr_shm = shared_memory.SharedMemory(chr_shm_name)
+	chr_tiles = np.ndarray(chr_shape, chr_dtype, chr_shm.buf)
+	data = FireEmblem1Data(
+		load_rom(rom_path, use_mmap = True), 
+		cache_dir = cache_dir, 
+		chr_tiles = chr_tiles,
+	)
+
+	_worker_state = (data, chr_shm, {})
+
+def _render_battle_anim_job(job, save_anim, tgt_fps):
+	data, chr_shm, unit_caches = _worker_state
+
+	# Projectile sprites are drawn from the unit's banks, so the metasprite caches can only be shared between jobs for the same unit
+	bg_msprites, msprites = unit_caches.setdefault(job.unit, ({}, {}))
+
+	save_anim(job, iter_battle_anim(data, job, tgt_fps = tgt_fps, bg_msprites = bg_msprites, msprites = msprites))
+
+	return job
+
+def render_battle_anims(data, rom_path, jobs, save_anim, *, max_workers = None, cache_dir = None, tgt_fps = 20):
+	"""Renders BattleAnimJobs across a process pool, calling save_anim(job, frames) in the process that renders each, with frames an iterator of what iter_battle_anim yields, rendered as it's gone through. Yields each job once save_anim returns, in no particular order. The workers are spawned, so save_anim must be picklable, e.g. a module level function or a functools.partial of one, and can only use what it's passed. rom_path must be the file data's ROM was loaded from. With max_workers = 1 everything runs in this process, in order."""
+	if max_workers == 1:
+		for job in jobs:
+			save_anim(job, iter_battle_anim(data, job, tgt_fps = tgt_fps))
+
+			yield job
+
+		return
+
+	chr_tiles = data.chr_tiles
+	chr_shm = shared_memory.SharedMemory(create = True, size = chr_tiles.nbytes)
+	try:
+		shm_tiles = np.ndarray(chr_tiles.shape, chr_tiles.dtype, chr_shm.buf)
+		shm_tiles[...] = chr_tiles
+		del shm_tiles
+
+		# Spawned rather than forked, as the caller may have threads running, e.g. saving images
+		with cf.ProcessPoolExecutor(
+			max_workers, 
+			mp_context = multiprocessing.get_context("spawn"), 
+			initializer = _init_battle_anim_worker, 
+			initargs = (rom_path, cache_dir, chr_shm.name, chr_tiles.shape, chr_tiles.dtype.str),
+		) as pool:
+			futures = [pool.submit(_render_battle_anim_job, job, save_anim, tgt_fps) for job in jobs]
+			try:
+				for future in cf.as_completed(futures):
+					yield future.result()
+
+			finally:
+				# Don't render the rest if the caller stopped early or a job failed
+				for future in futures:
+					future.cancel()
+
+	finally:
+		chr_shm.close()
+		chr_shm.unlink()
+
+	return
+
+def _pad_arrays(arrays, fill = 0):
+	# Stacks 1D sequences into one (sequence, position) int array, padded at the end with fill. Returns (lengths, array).
+	arrays = [np.asarray(arr, dtype = int) for arr in arrays]
+	lens = np.array([len(arr) for arr in arrays], dtype = int)
+	padded = np.full((len(arrays), lens.max(initial = 0) + 1), fill, dtype = int)
+	for row, arr in zip(padded, arrays):
+		row[:len(arr)] = arr
+
+	return lens, padded
+
+class BatchBattleScriptEmu:
+	"""Steps many battle animations at once. The state of each instance, and of each of its sprites, is held in arrays over instances, so a step is a few array operations per opcode in use rather than Python code per instance. Behaves like a BattleScriptEmu per BattleAnimJob, except that an instance hitting anything BattleScriptEmu raises on is marked failed and done instead. Frames are rendered by restoring an instance's state into a BattleScriptEmu, and fetching them doesn't change the instance. So its tile map never holds the background sprites rendering draws into it, and where a BattleScriptEmu would keep tiles from those in later frames, the frames can differ."""
+
+	# Stands in for a sprite_key of None. Projectile keys are 0 to -0xff.
+	_no_sprite_key = -0x100
+
+	def __init__(self, data, jobs):
+		self._data = data
+		self.jobs = list(jobs)
+		num_insts = len(self.jobs)
+
+		# The data tables, padded into arrays
+		scripts = [as_np_array(script, BattleScriptOp) for script in data.battle_scripts]
+		self._script_lens, self._script_opcodes = _pad_arrays([script["opcode"] for script in scripts])
+		self._script_params = _pad_arrays([script["param"] for script in scripts])[1]
+
+		paths = [as_np_array(path, XyOffset) for path in data.bpath_scripts]
+		self._path_lens, self._path_ys = _pad_arrays([path["y"] for path in paths])
+		self._path_xs = _pad_arrays([path["x"] for path in paths])[1]
+		self._mov_lens, self._mov_scripts = _pad_arrays(data.bmov_scripts)
+
+		# -1 past the end of an animation script, where BattleScriptEmu raises IndexError
+		self._anim_frame_cnts = _pad_arrays(data.banim_script_frame_cnts, -1)[1]
+		self._anim_lens, self._anim_scripts = _pad_arrays(data.banim_scripts)
+		max_aux_sprites = max(
+			sum(cnt < BAnimScriptFrameOps.Restart and frame_idx & 0x80 
+				for frame_idx, cnt in zip(script, cnts))
+			for script, cnts in zip(data.banim_scripts, data.banim_script_frame_cnts)
+		)
+
+		# Sequences ops step through over multiple frames. ShowHpBar uses 1 + team or 3 + team.
+		self._op_seqs = [
+			data.battle_hit_shake_offs, 
+			*data.battle_team_death_pal_idcs, 
+			*data.battle_team_peg_death_pal_idcs,
+		]
+		self._op_seq_lens, self._op_seq_values = _pad_arrays(self._op_seqs)
+
+		self._proj_data = np.array([tuple(proj) for proj in data.battle_proj_data], dtype = int)
+		self._proj_y_pos = np.array(list(data.battle_proj_y_pos), dtype = int)
+		self._flock_x_offs = np.array([tuple(offs) for offs in data.battle_flock_anim_x_offs], dtype = int)
+		self._pal_rows = np.array([tuple(row) for row in data.battle_pal_rows], dtype = np.uint8)
+
+		# For converting to and from BattleEmuState
+		self._chr_bank_addrs = {data.chr_tiles[idx].ctypes.data: idx for idx in range(len(data.chr_tiles))}
+		self._mov_idcs = {id(script): idx for idx, script in enumerate(data.bmov_scripts)}
+		self._path_idcs = {id(script): idx for idx, script in enumerate(data.bpath_scripts)}
+		self._anim_idcs = {id(script): idx for idx, script in enumerate(data.banim_scripts)}
+		# By address, as indexing the nested death palette arrays returns a new ctypes object every time
+		self._op_seq_idcs = {addressof(seq): idx for idx, seq in enumerate(self._op_seqs)}
+
+		# Per instance
+		self._team_idcs = np.array([job.team_idx for job in self.jobs], dtype = int)
+		self._units = np.array([job.unit for job in self.jobs], dtype = int)
+		self._script_idcs = np.array([job.script_idx for job in self.jobs], dtype = int)
+		self._misses = np.array([job.miss for job in self.jobs], dtype = bool)
+
+		self.total_frames = np.zeros(num_insts, dtype = int)
+		self.done = np.zeros(num_insts, dtype = bool)
+		self.failed = np.zeros(num_insts, dtype = bool)
+
+		self._script_pos = np.zeros(num_insts, dtype = int)
+		self._wait_for_mov = np.zeros(num_insts, dtype = bool)
+		self._op_seq = np.full(num_insts, -1, dtype = int)
+		self._op_seq_pos = np.zeros(num_insts, dtype = int)
+		self._counter = np.zeros(num_insts, dtype = int)
+
+		# -1 when not running
+		self._death_ctr = np.full(num_insts, -1, dtype = int)
+		self._flock_ctr = np.full(num_insts, -1, dtype = int)
+
+		self._bg_tiles = np.zeros((num_insts, *BattleScriptEmu.img_tiles[::-1]), dtype = np.uint8)
+		self._view_offs = np.zeros((num_insts, 2), dtype = int)
+		self._palette = None
+
+		# Per instance and sprite
+		shape = (num_insts, 3)
+		self._active = np.zeros(shape, dtype = bool)
+		self._sprite_teams = np.zeros(shape, dtype = int)
+		self._sprite_keys = np.full(shape, self._no_sprite_key, dtype = int)
+		self._chr_banks = np.full(shape, -1, dtype = int)
+		self._frame_idcs = np.zeros(shape, dtype = int)
+		self._aux_sprites = np.zeros((*shape, max(max_aux_sprites, 1)), dtype = int)
+		self._num_aux_sprites = np.zeros(shape, dtype = int)
+		self._bg_sprite = np.zeros(shape, dtype = bool)
+		self._pos = np.zeros((*shape, 2), dtype = int)
+		self._pos_offs = np.zeros((*shape, 2), dtype = int)
+		self._inner_attrs = np.zeros(shape, dtype = int)
+		self._remove_attrs = np.zeros(shape, dtype = int)
+		self._outer_attrs = np.zeros(shape, dtype = int)
+		self._rev_facing = np.zeros(shape, dtype = bool)
+		self._mov = np.full(shape, -1, dtype = int)
+		self._mov_pos = np.zeros(shape, dtype = int)
+		self._path = np.full(shape, -1, dtype = int)
+		self._path_pos = np.zeros(shape, dtype = int)
+		self._rev_mov_dir = np.zeros(shape, dtype = bool)
+		self._pause_anim = np.zeros(shape, dtype = bool)
+		self._anim = np.full(shape, -1, dtype = int)
+		self._anim_pos = np.zeros(shape, dtype = int)
+		self._anim_frames_left = np.zeros(shape, dtype = int)
+
+		# Initial states come from BattleScriptEmu itself, which also renders frames
+		self._unit_caches = {}
+		for inst_idx in range(num_insts):
+			self.set_state(inst_idx, self._new_emu(inst_idx).snapshot())
+
+		return
+
+	def update(self, num_frames = 1):
+		"""Advances every instance that isn't done by num_frames, like BattleScriptEmu.update."""
+		for frame in range(num_frames):
+			live = np.flatnonzero(~self.done)
+			if not len(live):
+				break
+
+			self._update_scripts(live)
+			live = live[~self.done[live]]
+
+			for ctr in (self._death_ctr, self._flock_ctr):
+				ctrs = ctr[live]
+				ctr[live] = np.where(ctrs > 0, ctrs - 1, ctrs)
+
+			self.total_frames[live] += 1
+
+			self._update_pos(live)
+			self._update_anim(live)
+
+		return
+
+	def get_frame(self, inst_idx):
+		"""Returns (image, palette) for an instance's current frame. Same lifetime rules as BattleScriptEmu.get_frame."""
+		# Rendered from a copy of the instance's tile map, as rendering draws the background sprites into it
+		emu = self._new_emu(inst_idx)
+		emu.restore(self.get_state(inst_idx))
+
+		return emu.get_frame()
+
+	def get_state(self, inst_idx):
+		"""Returns an instance's state as a BattleEmuState, which BattleScriptEmu.restore accepts."""
+		data = self._data
+		idx = inst_idx
+
+		sprites = []
+		for spr in range(3):
+			sprite = BattleScriptEmu.SpriteData()
+			sprite.team_idx = int(self._sprite_teams[idx, spr])
+			sprite_key = int(self._sprite_keys[idx, spr])
+			sprite.sprite_key = sprite_key if sprite_key != self._no_sprite_key else None
+			sprite.active = bool(self._active[idx, spr])
+
+			chr_bank_idx = int(self._chr_banks[idx, spr])
+			if chr_bank_idx >= 0:
+				sprite.chr_bank = data.get_chr_bank_array(chr_bank_idx)
+				sprite.chr_atlas = data.get_chr_bank_atlas(chr_bank_idx)
+
+			sprite.frame_idx = int(self._frame_idcs[idx, spr])
+			sprite.aux_sprites = self._aux_sprites[idx, spr, :self._num_aux_sprites[idx, spr]].tolist()
+			sprite.bg_sprite = bool(self._bg_sprite[idx, spr])
+			sprite.pos[:] = self._pos[idx, spr]
+			sprite.pos_offs[:] = self._pos_offs[idx, spr]
+			sprite.inner_attrs = int(self._inner_attrs[idx, spr])
+			sprite.remove_attrs = int(self._remove_attrs[idx, spr])
+			sprite.outer_attrs = int(self._outer_attrs[idx, spr])
+			sprite.rev_facing = bool(self._rev_facing[idx, spr])
+
+			mov, path = self._mov[idx, spr], self._path[idx, spr]
+			sprite.mov_script = data.bmov_scripts[mov] if mov >= 0 else None
+			sprite.path_script = data.bpath_scripts[path] if path >= 0 else None
+			sprite.mov_pos = int(self._mov_pos[idx, spr])
+			sprite.path_pos = int(self._path_pos[idx, spr])
+			sprite.rev_mov_dir = bool(self._rev_mov_dir[idx, spr])
+
+			anim = self._anim[idx, spr]
+			sprite.pause_anim = bool(self._pause_anim[idx, spr])
+			if anim >= 0:
+				sprite.anim_script = data.banim_scripts[anim]
+				sprite.anim_frame_cnts = data.banim_script_frame_cnts[anim]
+
+			sprite.anim_script_pos = int(self._anim_pos[idx, spr])
+			sprite.anim_frames_left = int(self._anim_frames_left[idx, spr])
+
+			sprites.append(sprite)
+
+		frame_ctrs = tuple((name, int(ctr[idx])) 
+			for name, ctr in (("death", self._death_ctr), ("flock", self._flock_ctr))
+			if ctr[idx] >= 0)
+		op_seq = self._op_seq[idx]
+
+		return BattleEmuState(
+			int(self.total_frames[idx]),
+			bool(self.done[idx]),
+			int(self._script_pos[idx]),
+			bool(self._wait_for_mov[idx]),
+			self._op_seqs[op_seq] if op_seq >= 0 else None,
+			int(self._op_seq_pos[idx]),
+			int(self._counter[idx]),
+			frame_ctrs,
+			tuple(sprites),
+			self._bg_tiles[idx].copy(),
+			tuple(self._view_offs[idx].tolist()),
+			self._palette[idx].copy(),
+		)
+
+	def set_state(self, inst_idx, state):
+		"""Sets an instance's state from a BattleEmuState of a BattleScriptEmu for the same job."""
+		idx = inst_idx
+		if self._palette is None:
+			self._palette = np.zeros((len(self.jobs), *state.palette.shape), dtype = state.palette.dtype)
+
+		self.total_frames[idx] = state.total_frames
+		self.done[idx] = state.done
+		self._script_pos[idx] = state.script_pos
+		self._wait_for_mov[idx] = state.wait_for_mov
+		self._op_seq[idx] = self._op_seq_idcs[addressof(state.script_op_seq)] if state.script_op_seq is not None else -1
+		self._op_seq_pos[idx] = state.script_op_pos
+		self._counter[idx] = state.counter
+
+		frame_ctrs = dict(state.frame_ctrs)
+		self._death_ctr[idx] = frame_ctrs.get("death", -1)
+		self._flock_ctr[idx] = frame_ctrs.get("flock", -1)
+
+		self._bg_tiles[idx] = state.bg_tiles
+		self._view_offs[idx] = state.view_offs
+		self._palette[idx] = state.palette
+
+		for spr, sprite in enumerate(state.sprites):
+			self._active[idx, spr] = sprite.active
+			self._sprite_teams[idx, spr] = sprite.team_idx
+			self._sprite_keys[idx, spr] = sprite.sprite_key if sprite.sprite_key is not None else self._no_sprite_key
+			self._chr_banks[idx, spr] = self._chr_bank_addrs[sprite.chr_bank.ctypes.data] if sprite.chr_bank is not None else -1
+
+			self._frame_idcs[idx, spr] = sprite.frame_idx
+			self._num_aux_sprites[idx, spr] = len(sprite.aux_sprites)
+			self._aux_sprites[idx, spr, :len(sprite.aux_sprites)] = sprite.aux_sprites
+			self._bg_sprite[idx, spr] = sprite.bg_sprite
+			self._pos[idx, spr] = sprite.pos
+			self._pos_offs[idx, spr] = sprite.pos_offs
+			self._inner_attrs[idx, spr] = sprite.inner_attrs
+			self._remove_attrs[idx, spr] = sprite.remove_attrs
+			self._outer_attrs[idx, spr] = sprite.outer_attrs
+			self._rev_facing[idx, spr] = sprite.rev_facing
+			self._mov[idx, spr] = self._mov_idcs[id(sprite.mov_script)] if sprite.mov_script is not None else -1
+			self._mov_pos[idx, spr] = sprite.mov_pos
+			self._path[idx, spr] = self._path_idcs[id(sprite.path_script)] if sprite.path_script is not None else -1
+			self._path_pos[idx, spr] = sprite.path_pos
+			self._rev_mov_dir[idx, spr] = sprite.rev_mov_dir
+			self._pause_anim[idx, spr] = sprite.pause_anim
+			self._anim[idx, spr] = self._anim_idcs[id(sprite.anim_script)] if sprite.anim_script is not None else -1
+			self._anim_pos[idx, spr] = sprite.anim_script_pos
+			self._anim_frames_left[idx, spr] = sprite.anim_frames_left
+
+		return
+
+	def _new_emu(self, inst_idx):
+		# Metasprite caches are shared per unit, like in the render_battle_anims workers
+		job = self.jobs[inst_idx]
+		bg_msprites, msprites = self._unit_caches.setdefault(job.unit, ({}, {}))
+
+		return BattleScriptEmu(
+			self._data, 
+			job.team_idx, 
+			job.unit, 
+			job.script_idx, 
+			job.init_frame_idx, 
+			job.miss, 
+			bg_msprites = bg_msprites, 
+			msprites = msprites,
+		)
+
+	def _fail(self, idx):
+		self.failed[idx] = self.done[idx] = True
+
+	def _check_range(self, idx, values, size):
+		# Fails instances where BattleScriptEmu would raise IndexError. Returns a mask of the others.
+		valid = (values >= 0) & (values < size)
+		self._fail(idx[~valid])
+
+		return valid
+
+	def _update_scripts(self, live):
+		idx = live[~self._wait_for_mov[live]]
+		script_idcs = self._script_idcs[idx]
+		script_pos = self._script_pos[idx]
+
+		ended = script_pos >= self._script_lens[script_idcs]
+		self.done[idx[ended]] = True
+		idx, script_idcs, script_pos = idx[~ended], script_idcs[~ended], script_pos[~ended]
+
+		# Each opcode's handler runs once, for every instance currently on it
+		opcodes = self._script_opcodes[script_idcs, script_pos]
+		params = self._script_params[script_idcs, script_pos]
+		for opcode in np.unique(opcodes).tolist():
+			on_op = opcodes == opcode
+			op_idx = idx[on_op]
+			hdlr = self._hdlrs.get(opcode, BatchBattleScriptEmu._error_hdlr)
+			cont = hdlr(self, op_idx, params[on_op])
+
+			if cont is None:
+				cont = False
+			self._script_pos[op_idx] += ~np.asarray(cont, dtype = bool)
+
+		return
+
+	def _update_pos(self, live):
+		inst, spr = np.nonzero(self._active[live] & (self._mov[live] >= 0))
+		inst = live[inst]
+
+		while len(inst):
+			path = self._path[inst, spr]
+			path_pos = self._path_pos[inst, spr]
+			has_path = path >= 0
+			path_done = has_path & (path_pos >= self._path_lens[path])
+			self._path[inst[path_done], spr[path_done]] = -1
+
+			step = has_path & ~path_done
+			step_inst, step_spr = inst[step], spr[step]
+			path, path_pos = path[step], path_pos[step]
+			signs = np.where(self._rev_mov_dir[step_inst, step_spr] ^ (self._sprite_teams[step_inst, step_spr] != 0), -1, 1)
+			self._pos[step_inst, step_spr, 0] += self._path_ys[path, path_pos]
+			self._pos[step_inst, step_spr, 1] += self._path_xs[path, path_pos] * signs
+			self._path_pos[step_inst, step_spr] += 1
+
+			# Start the next path, or finish moving
+			inst, spr = inst[~step], spr[~step]
+			mov = self._mov[inst, spr]
+			mov_pos = self._mov_pos[inst, spr]
+			more = mov_pos < self._mov_lens[mov]
+
+			end_inst, end_spr = inst[~more], spr[~more]
+			self._mov[end_inst, end_spr] = self._path[end_inst, end_spr] = -1
+			self._wait_for_mov[end_inst] = False
+
+			inst, spr = inst[more], spr[more]
+			self._path[inst, spr] = self._mov_scripts[mov[more], mov_pos[more]]
+			self._path_pos[inst, spr] = 0
+			self._mov_pos[inst, spr] += 1
+
+		return
+
+	def _update_anim(self, live):
+		inst, spr = np.nonzero(self._active[live] & ~self._pause_anim[live])
+		inst = live[inst]
+
+		frames_left = np.maximum(self._anim_frames_left[inst, spr] - 1, 0)
+		self._anim_frames_left[inst, spr] = frames_left
+		inst, spr = inst[frames_left == 0], spr[frames_left == 0]
+		self._num_aux_sprites[inst, spr] = 0
+
+		while len(inst):
+			anim = self._anim[inst, spr]
+			anim_pos = self._anim_pos[inst, spr]
+			num_frames = self._anim_frame_cnts[anim, anim_pos]
+
+			overrun = (num_frames < 0) | ((num_frames < BAnimScriptFrameOps.Restart) & (anim_pos >= self._anim_lens[anim]))
+			self._fail(inst[overrun])
+			inst, spr, anim, anim_pos, num_frames = inst[~overrun], spr[~overrun], anim[~overrun], anim_pos[~overrun], num_frames[~overrun]
+			frame_idcs = self._anim_scripts[anim, anim_pos]
+
+			is_frame = num_frames < BAnimScriptFrameOps.Restart
+			is_aux = is_frame & (frame_idcs & 0x80 != 0)
+			aux_inst, aux_spr = inst[is_aux], spr[is_aux]
+			self._aux_sprites[aux_inst, aux_spr, self._num_aux_sprites[aux_inst, aux_spr]] = frame_idcs[is_aux] & 0x7f
+			self._num_aux_sprites[aux_inst, aux_spr] += 1
+
+			is_main = is_frame & ~is_aux
+			self._frame_idcs[inst[is_main], spr[is_main]] = frame_idcs[is_main]
+
+			self._anim_pos[inst[is_frame], spr[is_frame]] += 1
+			self._anim_frames_left[inst[is_frame], spr[is_frame]] = num_frames[is_frame]
+
+			restart = num_frames == BAnimScriptFrameOps.Restart
+			self._anim_pos[inst[restart], spr[restart]] = 0
+
+			end = num_frames > BAnimScriptFrameOps.Restart
+			self._pause_anim[inst[end], spr[end]] = True
+
+			inst, spr = inst[is_aux | restart], spr[is_aux | restart]
+
+		return
+
+	def _init_projectile(self, idx, proj_idcs):
+		teams = self._team_idcs[idx]
+
+		self._sprite_teams[idx, 2] = self._sprite_teams[idx, teams]
+		self._sprite_keys[idx, 2] = -proj_idcs
+		self._bg_sprite[idx, 2] = False
+		self._pos[idx, 2, 0] = self._proj_y_pos[proj_idcs]
+		self._pos[idx, 2, 1] = self._pos[idx, teams, 1]
+		self._pos_offs[idx, 2] = 0
+		self._inner_attrs[idx, 2] = 0x20
+		self._remove_attrs[idx, 2] = 3
+		self._outer_attrs[idx, 2] = self._sprite_teams[idx, teams]
+
+		self._mov[idx, 2] = self._proj_data[proj_idcs, 1]
+		self._mov_pos[idx, 2] = 0
+		self._rev_facing[idx, 2] = self._rev_mov_dir[idx, 2] = False
+
+	def _nop_hdlr(self, idx, params):
+		return
+
+	def _error_hdlr(self, idx, params):
+		self._fail(idx)
+
+	def _begin_mov_hdlr(self, idx, params):
+		valid = self._check_range(idx, params & 0x3f, len(self._mov_lens))
+		idx, params = idx[valid], params[valid]
+		teams = self._team_idcs[idx]
+
+		self._rev_mov_dir[idx, teams] = params & 0x40 != 0
+		self._mov[idx, teams] = params & 0x3f
+		self._mov_pos[idx, teams] = 0
+		self._path[idx, teams] = -1
+
+		self._wait_for_mov[idx] = params & 0x80 == 0
+
+	def _spawn_anim_proj_hdlr(self, idx, params):
+		valid = self._check_range(idx, params, len(self._proj_data))
+		idx, params = idx[valid], params[valid]
+		teams = self._team_idcs[idx]
+
+		self._init_projectile(idx, params)
+
+		self._chr_banks[idx, 2] = self._chr_banks[idx, teams]
+		self._frame_idcs[idx, 2] = 1
+		self._anim[idx, 2] = self._proj_data[params, 0]
+		self._anim_pos[idx, 2] = 0
+		self._anim_frames_left[idx, 2] = 1
+		self._pause_anim[idx, 2] = False
+
+		self._active[idx, 2] = True
+
+	def _set_counter_hdlr(self, idx, params):
+		self._counter[idx] = params
+
+	def _wait_for_cond_hdlr(self, idx, params):
+		wait_ctr = params & 0x80 != 0
+		ctr_idx = idx[wait_ctr]
+		self._counter[ctr_idx] = (self._counter[ctr_idx] - 1) & 0xff
+
+		return np.where(
+			wait_ctr, 
+			self._counter[idx] != 0, 
+			self._frame_idcs[idx, self._team_idcs[idx]] != params,
+		)
+
+	def _set_layers_hdlr(self, idx, params):
+		self._bg_sprite[idx, self._team_idcs[idx]] = params & 2 != 0
+
+	def _begin_anim_hdlr(self, idx, params):
+		valid = self._check_range(idx, params, len(self._anim_scripts))
+		idx, params = idx[valid], params[valid]
+		teams = self._team_idcs[idx]
+		self._anim[idx, teams] = params
+		self._anim_pos[idx, teams] = 0
+		self._anim_frames_left[idx, teams] = 1
+		self._pause_anim[idx, teams] = False
+
+	def _flip_facing_hdlr(self, idx, params):
+		teams = self._team_idcs[idx]
+		self._rev_facing[idx, teams] = ~self._rev_facing[idx, teams]
+
+	def _load_packet_hdlr(self, idx, params):
+		packets_idcs = params ^ (self._team_idcs[idx] * 2)
+		valid = self._check_range(idx, packets_idcs, len(self._data.battle_script_packets))
+		idx, packets_idcs = idx[valid], packets_idcs[valid]
+
+		for packets_idx in np.unique(packets_idcs).tolist():
+			pkt_idx = idx[packets_idcs == packets_idx]
+			for packet in self._data.battle_script_packets[packets_idx]:
+				hdr = packet.hdr
+				y, x = divmod(hdr.ppu_addr - 0x2000, 0x20)
+				if hdr.vertical:
+					self._bg_tiles[pkt_idx, y:y + hdr.size, x] = packet.data
+				else:
+					self._bg_tiles[pkt_idx, y, x:x + hdr.size] = packet.data
+
+	def _pause_anim_hdlr(self, idx, params):
+		self._pause_anim[idx, self._team_idcs[idx]] = True
+
+	def _resume_anim_hdlr(self, idx, params):
+		self._pause_anim[idx, self._team_idcs[idx]] = False
+
+	def _show_hp_hdlr(self, idx, params):
+		# See BattleScriptEmu._show_hp_hdlr, which this follows branch by branch
+		cont = np.ones(len(idx), dtype = bool)
+		death_ctrs = self._death_ctr[idx]
+		no_seq = self._op_seq[idx] < 0
+
+		start_ctr = no_seq & (death_ctrs < 0)
+		self._death_ctr[idx[start_ctr]] = 0x20
+
+		start_seq = no_seq & (death_ctrs == 0)
+		seq_idx = idx[start_seq]
+		is_peg = self._units[seq_idx] == UnitTypes.PegasusKnight
+		self._op_seq[seq_idx] = np.where(is_peg, 3, 1) + (self._team_idcs[seq_idx] == 0)
+		self._op_seq_pos[seq_idx] = 0
+
+		# The death counter is gone once the sequence has finished
+		missing_ctr = ~no_seq & (death_ctrs < 0)
+		self._fail(idx[missing_ctr])
+
+		step = start_seq | (~no_seq & (death_ctrs == 0))
+		step_idx = idx[step]
+		seq = self._op_seq[step_idx]
+		seq_pos = self._op_seq_pos[step_idx]
+		more = seq_pos < self._op_seq_lens[seq]
+
+		pal_idx = step_idx[more]
+		tgt_teams = (self._team_idcs[pal_idx] == 0).astype(int)
+		pal_rows = self._op_seq_values[seq[more], seq_pos[more]]
+		valid = self._check_range(pal_idx, pal_rows, len(self._pal_rows))
+		self._palette[pal_idx[valid], :, tgt_teams[valid], :] = self._pal_rows[pal_rows[valid]][:, np.newaxis]
+		self._op_seq_pos[pal_idx] += 1
+		self._death_ctr[pal_idx] = 8
+
+		self._death_ctr[step_idx[~more]] = -1
+		cont[np.flatnonzero(step)[~more]] = False
+
+		return cont
+
+	def _hit_effect_hdlr(self, idx, params):
+		data = self._data
+		tgt_teams = (self._team_idcs[idx] == 0).astype(int)
+
+		start = self._op_seq[idx] < 0
+		start_idx = idx[start]
+		self._op_seq[start_idx] = 0
+		self._op_seq_pos[start_idx] = 0
+		hit_pal_idcs = np.array([data.battle_team_hit_pal_idcs[team] for team in tgt_teams[start].tolist()], dtype = int)
+		self._palette[start_idx, :, tgt_teams[start], :] = self._pal_rows[hit_pal_idcs][:, np.newaxis]
+
+		# Stepping past the end is StopIteration in BattleScriptEmu
+		seq = self._op_seq[idx]
+		seq_pos = self._op_seq_pos[idx]
+		more = seq_pos < self._op_seq_lens[seq]
+		self._fail(idx[~more])
+
+		offs = np.where(more, self._op_seq_values[seq, np.minimum(seq_pos, self._op_seq_values.shape[1] - 1)], 0)
+		self._view_offs[idx[more], 1] = offs[more]
+		self._op_seq_pos[idx[more]] += 1
+
+		stop = more & (offs == 0)
+		stop_idx = idx[stop]
+		self._op_seq[stop_idx] = -1
+		unit_pal_idcs = np.array([
+			data.battle_team_unit_pal_idcs[team][unit - 1] 
+			for team, unit in zip(tgt_teams[stop].tolist(), self._units[stop_idx].tolist())
+		], dtype = int)
+		self._palette[stop_idx, :, tgt_teams[stop], :] = self._pal_rows[unit_pal_idcs][:, np.newaxis]
+
+		return offs != 0
+
+	def _sprite_attrs_hdlr(self, idx, params):
+		self._inner_attrs[idx, self._team_idcs[idx]] = params
+
+	def _set_x_pos_hdlr(self, idx, params):
+		# BattleScriptEmu asserts only team 0 does this
+		teams = self._team_idcs[idx]
+		self._fail(idx[teams != 0])
+		self._pos[idx, teams, 1] = params
+
+	def _set_frame_hdlr(self, idx, params):
+		self._frame_idcs[idx, self._team_idcs[idx]] = params
+
+	def _spawn_proj_hdlr(self, idx, params):
+		valid = self._check_range(idx, params, len(self._proj_data))
+		idx, params = idx[valid], params[valid]
+
+		self._init_projectile(idx, params)
+
+		# NOT implemented: Parthia, Rain Bolt
+		horsemen = idx[self._units[idx] == UnitTypes.Horseman]
+		self._pos[horsemen, 2, 0] = 0x62
+
+		self._chr_banks[idx, 2] = self._chr_banks[idx, self._team_idcs[idx]]
+		self._frame_idcs[idx, 2] = self._proj_data[params, 0]
+		self._pause_anim[idx, 2] = True
+
+		self._active[idx, 2] = True
+
+	def _wait_for_proj_finish_hdlr(self, idx, params):
+		# Missing is not fully implemented
+		wait = self._misses[idx] & (self._mov[idx, 2] >= 0)
+
+		done_idx = idx[~wait]
+		self._mov[done_idx, 2] = self._path[done_idx, 2] = -1
+		self._active[done_idx, 2] = False
+
+		return wait
+
+	def _wait_for_proj_hit_hdlr(self, idx, params):
+		teams = self._team_idcs[idx]
+		proj_x = self._pos[idx, 2, 1]
+		tgt_x = self._pos[idx, teams ^ 1, 1]
+
+		return ~np.where(teams != 0, proj_x + 16 >= tgt_x, proj_x - 16 < tgt_x)
+
+	def _wait_for_proj_stop_hdlr(self, idx, params):
+		return self._mov[idx, 2] >= 0
+
+	def _spawn_unit_proj_hdlr(self, idx, params):
+		data = self._data
+		valid = self._check_range(idx, params, len(self._proj_data))
+		valid[valid] = self._check_range(idx[valid], self._units[idx[valid]] - 1, 
+			min(len(data.unit_battle_proj_y_offs), len(data.unit_battle_proj_frame_idcs)))
+		idx, params = idx[valid], params[valid]
+		unit_idcs = self._units[idx] - 1
+
+		self._chr_banks[idx, 2] = data.unit_battle_proj_chr_bank
+
+		self._init_projectile(idx, params)
+
+		y_offs = np.array([data.unit_battle_proj_y_offs[unit_idx] for unit_idx in unit_idcs.tolist()], dtype = int)
+		self._pos[idx, 2, 0] += y_offs
+		self._mov[idx, 2] = data.unit_proj_bmov_script_idx
+		self._frame_idcs[idx, 2] = [data.unit_battle_proj_frame_idcs[unit_idx] for unit_idx in unit_idcs.tolist()]
+		self._pause_anim[idx, 2] = True
+		self._active[idx, 2] = True
+
+	def _set_unit_frame_hdlr(self, idx, params):
+		data = self._data
+		valid = self._check_range(idx, params, 2)
+		valid[valid] = self._check_range(idx[valid], self._units[idx[valid]] - 1, len(data.battle_unit_spec_frame_idcs))
+		idx, params = idx[valid], params[valid]
+
+		self._frame_idcs[idx, self._team_idcs[idx]] = [
+			data.battle_unit_spec_frame_idcs[unit - 1][param]
+			for unit, param in zip(self._units[idx].tolist(), params.tolist())
+		]
+
+	def _flock_anim_hdlr(self, idx, params):
+		cont = np.ones(len(idx), dtype = bool)
+		valid = self._check_range(idx, self._counter[idx], len(self._flock_x_offs))
+		cont_idx = np.flatnonzero(valid)
+		idx = idx[valid]
+
+		self._pos_offs[idx, self._team_idcs[idx], 1] = (
+			self._flock_x_offs[self._counter[idx], self.total_frames[idx] & 1])
+
+		# A stopped flock counter is treated as 0, and restarted
+		restart = self._flock_ctr[idx] <= 0
+		restart_idx = idx[restart]
+		self._flock_ctr[restart_idx] = 16
+		self._counter[restart_idx] += 1
+
+		finished = restart & (self._counter[idx] >= 7)
+		self._flock_ctr[idx[finished]] = -1
+		cont[cont_idx[finished]] = False
+
+		return cont
+
+BatchBattleScriptEmu._hdlrs = {
+	BScriptOps.BeginMove: BatchBattleScriptEmu._begin_mov_hdlr,
+	BScriptOps.SpawnAnimProjectile: BatchBattleScriptEmu._spawn_anim_proj_hdlr,
+	BScriptOps.SetCounter: BatchBattleScriptEmu._set_counter_hdlr,
+	BScriptOps.WaitForCondition: BatchBattleScriptEmu._wait_for_cond_hdlr,
+	BScriptOps.SetLayers: BatchBattleScriptEmu._set_layers_hdlr,
+	BScriptOps.BeginAnim: BatchBattleScriptEmu._begin_anim_hdlr,
+	BScriptOps.FlipFacing: BatchBattleScriptEmu._flip_facing_hdlr,
+	BScriptOps.LoadPacket: BatchBattleScriptEmu._load_packet_hdlr,
+	BScriptOps.PauseAnim: BatchBattleScriptEmu._pause_anim_hdlr,
+	BScriptOps.ResumeAnim: BatchBattleScriptEmu._resume_anim_hdlr,
+	BScriptOps.ApplyDamage: BatchBattleScriptEmu._nop_hdlr,
+	BScriptOps.ShowHpBar: BatchBattleScriptEmu._show_hp_hdlr,
+	BScriptOps.ShakeScreen: BatchBattleScriptEmu._hit_effect_hdlr,
+	BScriptOps.SpriteAttributes: BatchBattleScriptEmu._sprite_attrs_hdlr,
+	BScriptOps.EndOfScript: BatchBattleScriptEmu._error_hdlr,
+	BScriptOps.SetXPos: BatchBattleScriptEmu._set_x_pos_hdlr,
+	BScriptOps.SetFrame: BatchBattleScriptEmu._set_frame_hdlr,
+	BScriptOps.SpawnProjectile: BatchBattleScriptEmu._spawn_proj_hdlr, 
+	BScriptOps.WaitForProjFinish: BatchBattleScriptEmu._wait_for_proj_finish_hdlr, 
+	BScriptOps.WaitForProjHit: BatchBattleScriptEmu._wait_for_proj_hit_hdlr, 
+	BScriptOps.WaitForProjStop: BatchBattleScriptEmu._wait_for_proj_stop_hdlr, 
+	BScriptOps.SpawnUnitProjectile: BatchBattleScriptEmu._spawn_unit_proj_hdlr, 
+	BScriptOps.SetUnitFrame: BatchBattleScriptEmu._set_unit_frame_hdlr,
+	BScriptOps.WaitForFxScript: BatchBattleScriptEmu._error_hdlr,
+	BScriptOps.SetProjCounter: BatchBattleScriptEmu._error_hdlr,
+	BScriptOps.SetSpecialFrame: BatchBattleScriptEmu._error_hdlr,
+	BScriptOps.SetBgPalette: BatchBattleScriptEmu._error_hdlr,
+	BScriptOps.PlaySound: BatchBattleScriptEmu._nop_hdlr,
+	BScriptOps.ShowFlockAnim: BatchBattleScriptEmu._flock_anim_hdlr,
+}
+
 def _dump_battle_script(script, prefix, used_ops):
 	for op_idx, op in enumerate(script):
 		fmt = _op_fmts.get(op.opcode)
@@ -13,6 +13,10 @@ from enum import Enum, IntEnum, IntFlag, auto
 import functools
 import hashlib
 import itertools
+import mmap
+import numpy as np
+import os
+from pathlib import Path
 import re
 
 namedtuple = colls.namedtuple
@@ -85,6 +89,98 @@ def leca4(banks, addr):
 def get_leca4(banks):
 	return functools.partial(leca4, banks)
 
+def leca4_array(banks, addrs):
+	"""leca4 for a whole array (ctypes or NumPy) of addresses at once. Returns an intp array of file offsets."""
+	addrs = np.array(addrs, np.intp)
+	banks = np.asarray(banks, np.intp)
+
+	return addrs - (addrs & 0xc000) + banks[addrs // 0x4000 - 2] * 0x4000 + 0x10
+
+def get_leca4_array(banks):
+	return functools.partial(leca4_array, banks)
+
+def offs_to_bank_addr(offs):
+	"""Inverse of leca4 for a file offset or an array of them. Returns (bank, addr), with bank 15 mapped to 0xc000 and all others to 0x8000."""
+	bank, addr = divmod(offs - 0x10, 0x4000)
+
+	return bank, addr + 0x8000 + (bank == 15) * 0x4000
+
+def load_rom(path, *, use_mmap = False):
+	if not use_mmap:
+		return bytearray(Path(path).read_bytes())
+
+	# ACCESS_COPY mappings are writable, as ctypes from_buffer requires, but writes stay private to the process. Unmodified pages are shared with every other process mapping the same file.
+	with open(path, "rb") as f:
+		return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_COPY)
+
+class TermIndex:
+	"""Sorted positions of each byte value in the ROM, split by stride and phase, so finding the next terminator is a binary search rather than a scan over a copy of the rest of the ROM. Position arrays are built the first time a value is searched for."""
+
+	def __init__(self, rom):
+		self._data = np.frombuffer(rom, np.uint8)
+		self._positions = {}
+
+		# (values, start, end, stride): offset for every search done, so they can be persisted and answered without building the position arrays
+		self.lookups = {}
+
+	def get_positions(self, value, stride = 1, phase = 0):
+		key = (int(value), stride, phase % stride)
+		poss = self._positions.get(key)
+		if poss is None:
+			if stride == 1:
+				poss = np.flatnonzero(self._data == key[0])
+			else:
+				poss = self.get_positions(value)
+				poss = poss[poss % stride == key[2]]
+
+			self._positions[key] = poss
+
+		return poss
+
+	def find(self, values, start, end = None, stride = 1):
+		"""Returns the offset of the first element of rom[start:end:stride] equal to any of values, or -1."""
+		if not isinstance(values, cabc.Sequence):
+			values = (values,)
+		values = tuple(map(int, values))
+		if end is None or end > len(self._data):
+			end = len(self._data)
+
+		key = (values, start, end, stride)
+		offs = self.lookups.get(key)
+		if offs is not None:
+			return offs
+
+		found = end
+		for value in values:
+			poss = self.get_positions(value, stride, start)
+			idx = np.searchsorted(poss, start)
+			if idx < len(poss):
+				found = min(found, int(poss[idx]))
+
+		offs = self.lookups[key] = found if found < end else -1
+
+		return offs
+
+	def index(self, values, start, end = None, stride = 1):
+		offs = self.find(values, start, end, stride)
+		if offs < 0:
+			raise ValueError("subsection not found")
+
+		return offs
+
+@functools.cache
+def get_np_dtype(ty):
+	# NumPy derives structured dtypes (including nested arrays and packing) directly from ctypes types, so these can't drift from the ctypes definitions
+	return np.dtype(ty)
+
+def as_np_array(arr, ty = None):
+	"""Returns a zero-copy structured array view of a ctypes array or structure. ty is only needed for the empty lists load_term_lists returns."""
+	ty = ty or getattr(arr, "_type_", type(arr))
+	if isinstance(arr, cabc.Sized) and not len(arr):
+		return np.zeros((0,), get_np_dtype(ty))
+
+	return np.frombuffer(arr, get_np_dtype(ty))
+
 def load_term_lists(
 	rom, 
 	leca, 
@@ -95,27 +191,24 @@ def load_term_lists(
 	terms = (0xef,), 
 	end_offs = None,
 	include_term = False,
+	term_index = None,
 ):
 	if not isinstance(terms, cabc.Sequence):
 		terms = (terms,)
 	tsize = sizeof(ty)
 	add_len = int(bool(include_term)) if tsize == 1 else 0
-
-	if len(terms) > 1:
-		# TODO: Replace with RE
-		def get_len(offs):
-			sl = rom[offs:end_offs:tsize]
-			lens = [sl.find(ch) for ch in terms]
-			return min(filter(lambda x: x >= 0, lens))
-	else:
-		term = terms[0]
-		get_len = lambda offs: rom[offs:end_offs:tsize].find(term)
+	term_index = term_index or TermIndex(rom)
 
 	addrs = (c_uint16_le * num_entries).from_buffer(rom, leca(tbl_addr))
 	lsts = []
 	for addr in addrs:
 		offs = leca(addr)
-		length = get_len(offs) + add_len
+		term_offs = term_index.find(terms, offs, end_offs, tsize)
+		# A missing single terminator still gives a length of -1, as bytes.find did
+		if term_offs < 0 and len(terms) > 1:
+			raise ValueError("none of the terminators found")
+
+		length = ((term_offs - offs) // tsize if term_offs >= 0 else -1) + add_len
 		lsts.append((ty * length).from_buffer(rom, offs) if length else [])
 
 	return addrs, lsts
@@ -131,8 +224,9 @@ def load_term_dicts(
 	end_offs = None,
 	include_term = False,
 	base_idx = 0,
+	term_index = None,
 ):
-	addrs, lsts = load_term_lists(rom, leca, tbl_addr, num_entries, ty = ty, terms = terms, end_offs = end_offs, include_term = include_term)
+	addrs, lsts = load_term_lists(rom, leca, tbl_addr, num_entries, ty = ty, terms = terms, end_offs = end_offs, include_term = include_term, term_index = term_index)
 	dicts = {idx + base_idx: val for idx, val in enumerate(lsts)}
 
 	return addrs, dicts
@@ -152,9 +246,11 @@ class TextDataBase:
 		miss_name_params = None,
 		loc_name_params = None,
 		game_str_params = None,
+		term_index = None,
 		):
 		self._rom = rom
 		self._chr_start_offs = chr_start_offs
+		self._term_index = term_index or TermIndex(rom)
 
 		if not script_params:
 			script_params = (
@@ -219,6 +315,7 @@ class TextDataBase:
 			terms = terms,
 			end_offs = self._chr_start_offs,
 			include_term = include_term,
+			term_index = self._term_index,
 		)
 
 	def get_script_addrs(self):
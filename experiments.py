@@ -119,8 +119,7 @@ def run(rom, data):
 		bank_addrs = colls.defaultdict(list)
 		offs = rom.find(bstr, 0x10, end_offs)
 		while offs >= 0:
-			bank, addr = divmod(offs - 0x10, 0x4000)
-			addr += 0x8000 if bank != 15 else 0xc000
+			bank, addr = offs_to_bank_addr(offs)
 
 			bank_addrs[bank].append(addr)
 
@@ -7,7 +7,8 @@
 """
 
 import numpy as np
-import numpy.ma as ma
+import zipfile
+import zlib
 
 from common import *
 import text_original
@@ -19,6 +20,74 @@ _nes_pal_str = """ 84  84  84    0  30 116    8  16 144   48   0 136   68   0 10
 236 238 236  168 204 236  188 188 236  212 178 236  236 174 236  236 174 212  236 180 176  228 196 144  204 210 120  180 222 120  168 226 144  152 226 180  160 214 228  160 162 160    0   0   0    0   0   0"""
 nes_pal = np.array(list(map(int, re.split(r"\s+", _nes_pal_str.strip()))), np.uint8).reshape(-1, 3)
 
+# Increment whenever the contents or meaning of the parsed ROM cache change
+cache_version = 1
+
+# Sprite bitmaps are plain uint8 arrays with this reserved index for transparent pixels. Real pixels never go above 0x1f.
+transparent_idx = 0xff
+
+def new_bitmap(shape):
+	return np.full(shape, transparent_idx, np.uint8)
+
+def blit_metasprite_tiles(bitmap, chr_bank, tile_idcs, ys, xs, attribs, pal_offs):
+	"""Draws all tiles of a metasprite at once. Parts are given as arrays in front-to-back order, with the flip bits in attribs and the value to add to each part's chr values in pal_offs. chr_bank may be a plain bank or a flip atlas from get_chr_bank_atlas. Pixels outside the bitmap are clipped."""
+	if not len(tile_idcs):
+		return
+
+	if chr_bank.ndim == 4:
+		tiles = chr_bank[(attribs >> 6) & 3, tile_idcs]
+	else:
+		tiles = chr_bank[tile_idcs]
+		tiles = np.where((attribs & 0x40)[:, None, None] != 0, tiles[:, :, ::-1], tiles)
+		tiles = np.where((attribs & 0x80)[:, None, None] != 0, tiles[:, ::-1, :], tiles)
+
+	height, width = bitmap.shape
+	offs = np.arange(8)
+	pix_ys, pix_xs = np.broadcast_arrays(
+		ys[:, None, None] + offs[None, :, None], 
+		xs[:, None, None] + offs[None, None, :],
+	)
+	opaque = (tiles != 0) & (pix_ys >= 0) & (pix_ys < height) & (pix_xs >= 0) & (pix_xs < width)
+	pix_ys, pix_xs = pix_ys[opaque], pix_xs[opaque]
+	values = (tiles + pal_offs.astype(np.uint8)[:, None, None])[opaque]
+
+	# The first opaque pixel at each position belongs to the front-most part
+	_, front_idcs = np.unique(pix_ys * width + pix_xs, return_index = True)
+	bitmap[pix_ys[front_idcs], pix_xs[front_idcs]] = values[front_idcs]
+
+	return
+
+def pad_map_arrays(maps, fill = 0):
+	"""Stacks maps of different sizes into one (map, row, col) array for batch rendering, padded at the bottom and right with fill."""
+	height = max(mp.shape[0] for mp in maps)
+	width = max(mp.shape[1] for mp in maps)
+	batch = np.full((len(maps), height, width), fill, np.uint8)
+	for batch_mp, mp in zip(batch, maps):
+		batch_mp[:mp.shape[0], :mp.shape[1]] = mp
+
+	return batch
+
+@functools.cache
+def get_palette_lut(clear_bits = 0, set_bits = 0):
+	"""Returns a lookup table that changes the palette of drawn sprite pixels as if their palette attribute bits had been cleared with clear_bits and then set with set_bits. Transparent pixels are left alone. Don't modify the table."""
+	lut = np.arange(256, dtype = np.uint8)
+	lut = (lut & ~np.uint8((clear_bits & 3) << 2)) | np.uint8((set_bits & 3) << 2)
+	lut[transparent_idx] = transparent_idx
+
+	return lut
+
+def remap_palette(bitmap, clear_bits = 0, set_bits = 0):
+	"""Returns a palette variant of a drawn bitmap without redrawing it. See get_palette_lut."""
+	return get_palette_lut(clear_bits, set_bits)[bitmap]
+
+def blit_bitmap(tgt, src):
+	"""Draws the non-transparent pixels of a bitmap over another of the same shape."""
+	np.copyto(tgt, src, where = src != transparent_idx)
+
+def fill_bitmap(bitmap, value = 0):
+	"""Returns a copy of a bitmap with transparent pixels replaced by value, e.g. to convert it to an image."""
+	return np.where(bitmap != transparent_idx, bitmap, np.uint8(value))
+
 class PacketHeader(LittleEndianStructure):
 	_pack_ = True
 	_fields_ = (
@@ -77,6 +146,9 @@ class SpriteFacing(IntEnum):
 
 Metasprite = namedtuple("Metasprite", ("tile_attribs", "tile_idcs"))
 
+def get_metasprite_np(sprite):
+	return Metasprite(as_np_array(sprite.tile_attribs), as_np_array(sprite.tile_idcs))
+
 class MetaspriteType2Sprite(Structure):
 	_pack_ = True
 	_fields_ = (
@@ -335,7 +407,7 @@ class BAnimScriptFrameOps(IntEnum):
 	End = 0xff
 
 class FireEmblem1Data:
-	def __init__(self, rom):
+	def __init__(self, rom, *, lazy = True, cache_dir = None, chr_tiles = None):
 		rom = self._rom = rom
 		hdr = self._hdr = iNesHeader.from_buffer(rom)
 
@@ -347,30 +419,162 @@ class FireEmblem1Data:
 		self.tile_banks = (TileBank * num_chr_banks).from_buffer(rom, chr_start_offs)
 		self.tile_banks_data = np.frombuffer(rom, np.uint8, sizeof(self.tile_banks), chr_start_offs).reshape((num_chr_banks, 256, 2, 8))
 
-		self._load_terrain_data()
+		self._term_index = TermIndex(rom)
+		self._cached_chr_tiles = None
+		self._chr_atlases = {}
+		self._metatile_atlases = {}
+		self._scripts = {}
+
+		self._rom_hash = hashlib.sha256(rom).digest()
+		self._cache_path = None
+		if cache_dir is not None:
+			self._cache_path = Path(cache_dir).joinpath(f"{self._rom_hash.hex()}.npz")
+			self.load_cache(self._cache_path)
+
+		# Already decoded CHR tiles, e.g. shared with another process
+		if chr_tiles is not None:
+			self._cached_chr_tiles = chr_tiles
 
 		self._map_rom_banks = (6, 15)
 		self._map_leca = get_leca4(self._map_rom_banks)
-		self._load_map_gfx()		
-		self._load_map_data()
-		self._load_map_obj_data()
-
 		self.port_leca = get_leca4((10, 15))
-		self._load_port_gfx()
-		self._load_port_infos()
 
-		self._load_unit_data()
-		self._load_item_data()
+		# Subsystems are loaded the first time one of their attributes is accessed (see __getattr__)
+		self._loaded = set()
+		if not lazy:
+			self.load_all()
 
-		self._load_battle_gfx()
+		return
+
+	def __getattr__(self, name):
+		# Only called when normal lookup fails, so each loader's results are memoized as regular attributes
+		loader = self._lazy_attrs.get(name)
+		if loader is None or loader in self.__dict__.get("_loaded", ()):
+			raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+		self._run_loader(loader)
+
+		return getattr(self, name)
+
+	def load_all(self):
+		for loader in self._loader_attrs:
+			if loader not in self._loaded:
+				self._run_loader(loader)
+
+	def _run_loader(self, loader):
+		# Marked as loaded first so a loader reading its own attributes doesn't recurse. If it fails, what it set so far is dropped so the next access runs it again.
+		self._loaded.add(loader)
+		try:
+			loader(self)
+		except BaseException:
+			self._loaded.discard(loader)
+			for name in self._loader_attrs[loader]:
+				self.__dict__.pop(name, None)
+
+			raise
+
+	def load_cache(self, path):
+		"""Loads terminator lookups, decoded CHR tiles and decoded scripts from a cache written by save_cache. Returns False if the cache doesn't exist, is damaged or doesn't match this ROM and cache version."""
+		# Nothing is used unless the whole cache reads back
+		lookups = {}
+		scripts = {}
+		try:
+			with np.load(path) as cache:
+				if (cache["version"] != cache_version 
+					or cache["rom_hash"].tobytes() != self._rom_hash):
+					return False
+
+				for name in cache.files:
+					if not name.startswith("terms_"):
+						continue
+
+					values = tuple(int(x, 16) for x in name.split("_")[1:])
+					for start, end, stride, offs in cache[name].tolist():
+						lookups[(values, start, end, stride)] = offs
+
+				chr_tiles = cache["chr_tiles"]
+
+				script_data = cache["script_data"].tobytes()
+				script_ends = itertools.accumulate(cache["script_lens"].tolist())
+				op_infos = cache["script_op_infos"].tolist()
+				op_ends = itertools.accumulate(cache["script_op_cnts"].tolist())
+				script_start = op_start = 0
+				for script_id, script_end, op_end in zip(
+					map(tuple, cache["script_ids"].tolist()), script_ends, op_ends):
+					scripts[script_id] = (
+						bytearray(script_data[script_start:script_end]),
+						list(map(tuple, op_infos[op_start:op_end])),
+					)
+
+					script_start, op_start = script_end, op_end
+
+		except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile, zlib.error):
+			return False
+
+		self._term_index.lookups.update(lookups)
+		if chr_tiles.size:
+			self._cached_chr_tiles = chr_tiles
+		self._scripts.update(scripts)
+
+		return True
+
+	def save_cache(self, path = None):
+		path = Path(path or self._cache_path)
+		arrays = {
+			"version": np.array(cache_version),
+			"rom_hash": np.frombuffer(self._rom_hash, np.uint8),
+			"chr_tiles": self.chr_tiles,
+		}
 
-		self._load_text()
+		lookup_rows = colls.defaultdict(list)
+		for (values, start, end, stride), offs in self._term_index.lookups.items():
+			lookup_rows[values].append((start, end, stride, offs))
+
+		for values, rows in lookup_rows.items():
+			name = "_".join(["terms"] + [f"{value:02x}" for value in values])
+			arrays[name] = np.array(rows, np.int64)
+
+		scripts = list(self._scripts.items())
+		arrays.update({
+			"script_ids": np.array([script_id for script_id, _ in scripts], np.int64).reshape((-1, 3)),
+			"script_data": np.frombuffer(b"".join((bytes(script) for _, (script, ops) in scripts)), np.uint8),
+			"script_lens": np.array([len(script) for _, (script, ops) in scripts], np.int64),
+			"script_op_infos": np.array([op for _, (script, ops) in scripts for op in ops], np.int64).reshape((-1, 2)),
+			"script_op_cnts": np.array([len(ops) for _, (script, ops) in scripts], np.int64),
+		})
+
+		# Write to a temporary file first so concurrent runs never see a partial cache
+		path.parent.mkdir(parents = True, exist_ok = True)
+		tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+		with open(tmp_path, "wb") as f:
+			np.savez_compressed(f, **arrays)
+
+		os.replace(tmp_path, path)
+
+	def get_cache_entries(self):
+		"""Returns the terminator lookups and decoded scripts that save_cache writes, e.g. to pass to add_cache_entries in another process."""
+		return dict(self._term_index.lookups), dict(self._scripts)
+
+	def add_cache_entries(self, entries):
+		lookups, scripts = entries
+		self._term_index.lookups.update(lookups)
+		self._scripts.update(scripts)
+
+	def _load_chr_tiles(self):
+		tiles = self._cached_chr_tiles
+		if tiles is None:
+			# Decode every bank in one go: (bank, tile, plane, row) bytes -> (bank, tile, plane, row, col) bits
+			bits = np.unpackbits(self.tile_banks_data[..., np.newaxis], axis = -1)
+			tiles = bits[:, :, 0] | (bits[:, :, 1] << 1)
+
+		self.chr_tiles = tiles
 
 		return
 
 	def _load_terrain_data(self):
 		rom = self._rom
 		leca = self.terrain_img_leca = get_leca4((5, 15))
+		leca_array = get_leca4_array((5, 15))
 
 		self.pc_metatile_terrain_types = (c_uint8 * num_metatiles).from_buffer(rom, leca(0xe828))
 		self.npc_metatile_terrain_types = (c_uint8 * num_metatiles).from_buffer(rom, leca(0xe8f8))
@@ -379,16 +583,17 @@ class FireEmblem1Data:
 
 		self.unit_terrain_cost_addrs = (c_uint16_le * num_terrains).from_buffer(rom, leca(0xe9c8))
 		self.unit_terrain_costs = [
-			(c_uint8 * num_terrains).from_buffer(rom, leca(addr)) 
-			for addr in self.unit_terrain_cost_addrs
+			(c_uint8 * num_terrains).from_buffer(rom, offs) 
+			for offs in leca_array(self.unit_terrain_cost_addrs).tolist()
 		]
 
 		self.terrain_img_metasprite_list_addr = c_uint16_le.from_buffer(rom, leca(0xbfd0)).value
 		self.terrain_img_metasprite_addrs = (c_uint16_le * num_terrain_names).from_buffer(rom, leca(self.terrain_img_metasprite_list_addr))
 		self.terrain_img_metasprites = [
-			self._load_metasprite_type2(leca(addr))
-			for addr in self.terrain_img_metasprite_addrs
+			self._load_metasprite_type2(offs)
+			for offs in leca_array(self.terrain_img_metasprite_addrs).tolist()
 		]
+		self.terrain_img_metasprites_np = list(map(as_np_array, self.terrain_img_metasprites))
 
 		return
 
@@ -427,6 +632,7 @@ class FireEmblem1Data:
 		sprite_addrs = self.map_sprite_addr_tbls = [(c_uint16_le * 0x60).from_buffer(rom, leca(self.map_sprite_tbls_addr[0]))]
 		sprites = [self._load_metasprite(leca, addr) for addr in sprite_addrs[0]]
 		self.map_sprite_tbls = [sprites]
+		self.map_sprite_tbls_np = [list(map(get_metasprite_np, sprites))]
 		
 		self.map_sprites = []
 		for sprite_idx in range(num_units):
@@ -442,6 +648,15 @@ class FireEmblem1Data:
 
 		return
 
+	def _load_map_anim_masks(self):
+		# Tiles that differ between any of the map animation banks, and the metatiles that use them. These are the only parts of a map that change between animation frames.
+		anim_bank_idcs = sorted({bank_idx for bank_idx, num_frames in self.map_anim_banks})
+		anim_tiles = self.chr_tiles[anim_bank_idcs]
+		self.map_anim_tile_mask = (anim_tiles != anim_tiles[0]).any(axis = (0, 2, 3))
+		self.map_anim_metatile_mask = self.map_anim_tile_mask[self.metatile_arrays].any(axis = (1, 2))
+
+		return
+
 	def _load_map_data(self):
 		rom = self._rom
 		leca = self._map_leca
@@ -475,9 +690,11 @@ class FireEmblem1Data:
 		leca = self.map_obj_leca = get_leca4((8, 15))
 
 		self.map_npc_list_addrs, self.map_npc_lists = load_term_dicts(
-			rom, leca, 0x8aa3, num_maps, ty = MapNpc, terms = 0, base_idx = 1)
+			rom, leca, 0x8aa3, num_maps, ty = MapNpc, terms = 0, base_idx = 1, term_index = self._term_index)
 		self.map_pc_list_addrs, self.map_pc_lists = load_term_dicts(
-			rom, leca, 0x8490, num_maps, ty = MapPc, terms = 0, base_idx = 1)
+			rom, leca, 0x8490, num_maps, ty = MapPc, terms = 0, base_idx = 1, term_index = self._term_index)
+		self.map_npc_lists_np = {idx: as_np_array(l, MapNpc) for idx, l in self.map_npc_lists.items()}
+		self.map_pc_lists_np = {idx: as_np_array(l, MapPc) for idx, l in self.map_pc_lists.items()}
 
 		self.map_start_loc_list_addrs = (c_uint16_le * num_maps).from_buffer(rom, leca(0x8790))
 		self.map_start_loc_lists = {}
@@ -490,30 +707,35 @@ class FireEmblem1Data:
 
 		leca = self.map_shop_leca = get_leca4((11, 15))
 		self.map_shop_list_addrs, self.map_shop_lists = load_term_dicts(
-			rom, leca, 0xa4ff, num_maps, ty = MapShop, terms = 0xf0)
+			rom, leca, 0xa4ff, num_maps, ty = MapShop, terms = 0xf0, term_index = self._term_index)
 		self.inv_list_addrs, self.inv_lists = load_term_lists(
-			rom, leca, 0xa6c2, 20, terms = 0xf0)
+			rom, leca, 0xa6c2, 20, terms = 0xf0, term_index = self._term_index)
+		self.map_shop_lists_np = {idx: as_np_array(l, MapShop) for idx, l in self.map_shop_lists.items()}
 
 		leca = self.map_dlg_pc_lists = get_leca4((3, 15))
+		leca_array = get_leca4_array((3, 15))
 		self.map_dlg_pc_list_addrs = (c_uint16_le * num_maps).from_buffer(rom, leca(0x9466))
 		self.map_dlg_pc_lists = [
-			(MapPc * 2).from_buffer(rom, leca(addr))
-			for addr in self.map_dlg_pc_list_addrs
+			(MapPc * 2).from_buffer(rom, offs)
+			for offs in leca_array(self.map_dlg_pc_list_addrs).tolist()
 		]
+		self.map_dlg_pc_lists_np = list(map(as_np_array, self.map_dlg_pc_lists))
 
 		return
 
 	def _load_port_gfx(self):
 		rom = self._rom
 		leca = self.port_leca
+		leca_array = get_leca4_array((10, 15))
 
 		self.port_chr_bank_idcs = (c_uint8 * 0x4f).from_buffer(rom, leca(0x8a14))
 
 		self.port_pal_pack_addrs = (c_uint16_le * 0x50).from_buffer(rom, leca(0xb71c))
 		self.port_pal_idcs = (c_uint8 * 0x4f).from_buffer(rom, leca(0x8a63))
-		self.port_pal_packs = []
-		for pack_addr in self.port_pal_pack_addrs:
-			self.port_pal_packs.append(Packet(rom, leca(pack_addr)))
+		self.port_pal_packs = [
+			Packet(rom, offs) 
+			for offs in leca_array(self.port_pal_pack_addrs).tolist()
+		]
 		
 		self.port_sprite_tbl_addrs = (c_uint16_le * 1).from_buffer(rom, leca(0xbfd0))
 		self.port_sprite_addr_tbls = [(c_uint16_le * 0xff).from_buffer(rom, leca(self.port_sprite_tbl_addrs[0]))]
@@ -522,6 +744,11 @@ class FireEmblem1Data:
 		for tbl_idx, addrs in enumerate(self.port_sprite_addr_tbls):
 			tbl_sprites = [self._load_metasprite(leca, addr) for addr in addrs]
 			self.port_sprites.append(tbl_sprites)
+
+		self.port_sprites_np = [
+			list(map(get_metasprite_np, tbl_sprites)) 
+			for tbl_sprites in self.port_sprites
+		]
 		
 	def _load_port_infos(self):
 		rom = self._rom
@@ -530,7 +757,7 @@ class FireEmblem1Data:
 		self.port_base_sprite_num = (c_uint8 * 0x4f).from_buffer(rom, leca(0x89c5))
 		self.port_frame_sprite_list_addrs = (c_uint16_le * 0x4f).from_buffer(rom, leca(0x8795))
 		self.port_frame_times_list_addrs, times_lists = load_term_lists(
-			rom, leca, 0x88e2, 0x4f, terms = 0xf0)
+			rom, leca, 0x88e2, 0x4f, terms = 0xf0, term_index = self._term_index)
 		self.port_infos = []
 		for port_idx, times_list in enumerate(times_lists):
 			sprite_list_addr = self.port_frame_sprite_list_addrs[port_idx]
@@ -550,21 +777,26 @@ class FireEmblem1Data:
 	def _load_unit_data(self):
 		rom = self._rom
 		leca = get_leca4((0, 15))
+		leca_array = get_leca4_array((0, 15))
 
 		self.unit_type_info_addrs = (c_uint16_le * num_units).from_buffer(rom, leca(0xec04))
 		self.unit_type_infos = [
-			EnemyUnitTypeInfo.from_buffer(rom, leca(addr))
-			for addr in self.unit_type_info_addrs
+			EnemyUnitTypeInfo.from_buffer(rom, offs)
+			for offs in leca_array(self.unit_type_info_addrs).tolist()
 		]
 
 		self.char_growth_info_addrs = (c_uint16_le * num_pcs).from_buffer(rom, leca(0xe1e0))
 		self.char_growth_infos = [
-			CharGrowthChanceInfo.from_buffer(rom, leca(addr)) 
-			for addr in self.char_growth_info_addrs
+			CharGrowthChanceInfo.from_buffer(rom, offs) 
+			for offs in leca_array(self.char_growth_info_addrs).tolist()
 		]
 
+		# The entries aren't contiguous in the ROM, so these are copies
+		self.unit_type_infos_np = np.concatenate(list(map(as_np_array, self.unit_type_infos)))
+		self.char_growth_infos_np = np.concatenate(list(map(as_np_array, self.char_growth_infos)))
+
 		offs = leca(0xedb5)
-		num_entries = rom.index(0, offs, self._chr_start_offs) - offs
+		num_entries = self._term_index.index(0, offs, self._chr_start_offs) - offs
 		self.talk_src_pc_ids = (c_uint8 * num_entries).from_buffer(rom, offs)
 		self.talk_tgt_npc_ids = (c_uint8 * num_entries).from_buffer(rom, leca(0xedc4))
 		self.talk_script_idcs = (c_uint8 * num_entries).from_buffer(rom, leca(0xedd2))
@@ -576,7 +808,7 @@ class FireEmblem1Data:
 		rom = self._rom
 		leca = self.item_info_leca = get_leca4((6, 15))
 		load_byte_tbl = lambda x: (c_uint8 * num_items).from_buffer(rom, leca(x))
-		load_byte_lists = lambda addr, num_entries, terms: load_term_lists(rom, leca, addr, num_entries, terms = terms, end_offs = self._chr_start_offs)
+		load_byte_lists = lambda addr, num_entries, terms: load_term_lists(rom, leca, addr, num_entries, terms = terms, end_offs = self._chr_start_offs, term_index = self._term_index)
 
 		self.item_mights = load_byte_tbl(0xd657)
 		self.item_reqs = load_byte_tbl(0xd6b3)
@@ -665,6 +897,7 @@ class FireEmblem1Data:
 			self.unit_bsprite_bg_frame_tbl_addrs[bank_idx] = facing_addrs
 
 		leca = get_leca4((5, 15))
+		leca_array = get_leca4_array((5, 15))
 		self.unit_bsprite_chr_banks = rom_bytes(0x9169, num_ext_units)
 		self.unit_bsprite_init_frame_tbl_addrs = (
 			rom_addrs(0x9258, num_ext_units))
@@ -700,13 +933,21 @@ class FireEmblem1Data:
 			self.unit_battle_script_idcs.append(idcs)
 
 		load_lists = functools.partial(
-			load_term_lists, rom, leca, end_offs = self._chr_start_offs)
+			load_term_lists, 
+			rom, 
+			leca, 
+			end_offs = self._chr_start_offs, 
+			term_index = self._term_index,
+		)
 		self.battle_script_addrs, self.battle_scripts = load_lists(
 			0xb04f, 0x31, ty = BattleScriptOp, terms = 0xe)
 
 		self.bfx_script_addrs, self.bfx_scripts = load_lists(
 			0xb6c6, 0x23, ty = BattleScriptOp, terms = 0)
 
+		self.battle_scripts_np = [as_np_array(l, BattleScriptOp) for l in self.battle_scripts]
+		self.bfx_scripts_np = [as_np_array(l, BattleScriptOp) for l in self.bfx_scripts]
+
 		self.base_battle_pal_pack_addr = rom_addrs(0xbcee)[0]
 		self.base_battle_pal_pack = (
 			Packet(rom, leca(self.base_battle_pal_pack_addr)))
@@ -740,7 +981,7 @@ class FireEmblem1Data:
 
 		offs = leca(0x9f70)
 		self.battle_hit_shake_offs = (
-			rom_bytes(0x9f70, rom.index(0, offs) - offs + 1))
+			rom_bytes(0x9f70, self._term_index.index(0, offs) - offs + 1))
 
 		self.battle_team_hit_pal_idcs = rom_bytes(0xa042, 2)
 		self.battle_team_unit_pal_idcs = (
@@ -748,24 +989,30 @@ class FireEmblem1Data:
 		self.battle_mamkute_stone_pal_idcs = rom_bytes(0x915e, 11)
 		self.battle_pal_row_addrs = rom_addrs(0xbd16, 0x31)
 		self.battle_pal_rows = [
-			rom_bytes(addr, 4) 
-			for addr in self.battle_pal_row_addrs
+			(c_uint8 * 4).from_buffer(rom, offs) 
+			for offs in leca_array(self.battle_pal_row_addrs).tolist()
 		]
 		self.battle_team_death_pal_idcs_addrs = rom_addrs(0x9ee9, 2)
 		self.battle_team_death_pal_idcs, self.battle_team_peg_death_pal_idcs = (
-			((c_uint8 * 4) * 2).from_buffer(rom, leca(addr))
-			for addr in self.battle_team_death_pal_idcs_addrs
+			((c_uint8 * 4) * 2).from_buffer(rom, offs)
+			for offs in leca_array(self.battle_team_death_pal_idcs_addrs).tolist()
 		)
 
 		leca = get_leca4((0, 15))
 		load_lists = functools.partial(
-			load_term_lists, rom, leca, end_offs = self._chr_start_offs)
+			load_term_lists, 
+			rom, 
+			leca, 
+			end_offs = self._chr_start_offs, 
+			term_index = self._term_index,
+		)
 		self.bmov_script_addrs, self.bmov_scripts = load_lists(
 			0xac52, 0x21, terms = 0xff)
 		self.unit_proj_bmov_script_idx = 0x1b # Is 0x1b correct?
 
 		self.bpath_script_addrs, self.bpath_scripts = load_lists(
 			0xadee, 0x32, ty = XyOffset, terms = 0x80)
+		self.bpath_scripts_np = [as_np_array(l, XyOffset) for l in self.bpath_scripts]
 		self.banim_script_frame_cnts_addrs, self.banim_script_frame_cnts = load_lists(
 			0x9fe0,
 			0x19,
@@ -789,7 +1036,8 @@ class FireEmblem1Data:
 		self.text = None
 		for text_mod in (text_original, text_polinym):
 			if text_mod.TextData.is_rom(rom):
-				self.text = text_mod.TextData(rom, self._chr_start_offs)
+				self.text = text_mod.TextData(
+					rom, self._chr_start_offs, term_index = self._term_index)
 				break
 
 		assert self.text
@@ -824,7 +1072,8 @@ class FireEmblem1Data:
 		sprite_offs = leca(sprite_addr)
 		attribs_addr = c_uint16_le.from_buffer(rom, sprite_offs).value
 		attribs_offs = leca(attribs_addr)
-		num_tiles = rom[attribs_offs::sizeof(SpriteAttribs)].index(0xf0)
+		num_tiles = (self._term_index.index(
+			0xf0, attribs_offs, stride = sizeof(SpriteAttribs)) - attribs_offs) // sizeof(SpriteAttribs)
 		tile_attribs = (SpriteAttribs * num_tiles).from_buffer(rom, attribs_offs)
 		tile_idcs = (c_uint8 * num_tiles).from_buffer(rom, sprite_offs + 2)
 
@@ -844,16 +1093,32 @@ class FireEmblem1Data:
 
 	def get_miss_dlg_info(self, miss_idx):
 		offs = self.miss_info_leca(self.miss_dlg_addrs[miss_idx - 1])
-		num_infos = self._rom[offs::sizeof(MissionDialogInfo)].index(0)
+		num_infos = (self._term_index.index(
+			0, offs, stride = sizeof(MissionDialogInfo)) - offs) // sizeof(MissionDialogInfo)
 		infos = (MissionDialogInfo * num_infos).from_buffer(self._rom, offs)
 
 		return infos
 
+	def get_miss_dlg_info_np(self, miss_idx):
+		return as_np_array(self.get_miss_dlg_info(miss_idx), MissionDialogInfo)
+
 	def get_chr_bank_array(self, bank_idx):
-		bank_data = np.unpackbits(self.tile_banks_data[bank_idx]).reshape((256, 2, 8, 8)).transpose(1, 0, 2, 3)
+		"""Returns a view of one bank of chr_tiles. These are views of a shared tensor, so don't modify them."""
+		return self.chr_tiles[bank_idx]
+
+	def get_chr_bank_atlas(self, bank_idx):
+		"""Returns a bank's tiles in all 4 flip orientations, indexed by (attribs >> 6, tile_idx). These are cached, so don't modify them."""
+		atlas = self._chr_atlases.get(bank_idx)
+		if atlas is None:
+			tiles = self.get_chr_bank_array(bank_idx)
+			atlas = self._chr_atlases[bank_idx] = np.stack((
+				tiles, 
+				tiles[:, :, ::-1], 
+				tiles[:, ::-1, :], 
+				tiles[:, ::-1, ::-1],
+			))
 
-		comb_data = bank_data[0] + (bank_data[1] << 1)
-		return ma.masked_equal(comb_data, 0)
+		return atlas
 
 	def get_palette_pack_array(self, pack, sprite_pal = False):
 		if sprite_pal:
@@ -902,15 +1167,53 @@ class FireEmblem1Data:
 
 	def get_tiles_bitmap(self, chr_bank, tiles, attribs):
 		bitmap = chr_bank[tiles].transpose(0, 2, 1, 3).reshape((tiles.shape[0] * 8, -1))
-		bitmap += np.repeat(np.repeat((attribs & 3) << 2, 16, 0), 16, 1)
 
-		return bitmap
+		# chr value 0 is the shared background color and stays index 0 whatever the attributes
+		return np.where(bitmap == 0, 0, bitmap + np.repeat(np.repeat((attribs & 3) << 2, 16, 0), 16, 1))
 
 	def get_map_bitmap(self, chr_bank, _map):
 		tiles, attribs = self.get_map_tilemap(_map)
 
 		return self.get_tiles_bitmap(chr_bank, tiles, attribs)
 
+	def get_metatile_atlas(self, bank_idx):
+		"""Returns the 16x16 bitmaps of all metatiles drawn with a chr bank, attributes included. These are cached, so don't modify them."""
+		atlas = self._metatile_atlases.get(bank_idx)
+		if atlas is None:
+			tiles = self.get_chr_bank_array(bank_idx)[self.metatile_arrays]
+			atlas = tiles.transpose(0, 1, 3, 2, 4).reshape((-1, 16, 16))
+			atlas = np.where(atlas == 0, 0, atlas + ((self.metatile_attribs & 3) << 2)[:, np.newaxis, np.newaxis])
+
+			self._metatile_atlases[bank_idx] = atlas
+
+		return atlas
+
+	def get_maps_bitmap(self, bank_idx, maps):
+		"""Renders a map, or a batch of maps from pad_map_arrays, with a single gather from the metatile atlas."""
+		maps = np.asarray(maps)
+		bitmaps = self.get_metatile_atlas(bank_idx)[maps]
+		*batch_shape, height, width = maps.shape
+
+		return bitmaps.swapaxes(-3, -2).reshape(tuple(batch_shape) + (height * 16, width * 16))
+
+	def update_map_bitmap(self, bitmap, bank_idx, _map, metatile_mask):
+		"""Redraws only the map cells whose metatile is set in metatile_mask, e.g. map_anim_metatile_mask to switch a get_maps_bitmap bitmap to another animation bank. Returns the changed bounds in pixels as ((top, left), (bottom, right)), or None if nothing changed."""
+		_map = np.asarray(_map)
+		rows, cols = np.nonzero(metatile_mask[_map])
+		if not len(rows):
+			return None
+
+		# The cells are written through a reshaped view, which would be a copy of a non-contiguous bitmap
+		assert bitmap.flags.c_contiguous
+		height, width = _map.shape
+		cells = bitmap.reshape((height, 16, width, 16))
+		cells[rows, :, cols, :] = self.get_metatile_atlas(bank_idx)[_map[rows, cols]]
+
+		return np.array((
+			(rows.min() * 16, cols.min() * 16),
+			((rows.max() + 1) * 16, (cols.max() + 1) * 16),
+		), dtype = int)
+
 	def get_map_bank(self, map_idx):
 		for bank in self.map_banks:
 			if map_idx >= bank.start_idx and map_idx < bank.end_idx:
@@ -941,22 +1244,21 @@ class FireEmblem1Data:
 		return arr[:, 2].max() + 8, arr[:, 1].max() + 8
 
 	def draw_sprite(self, bitmap, chr_bank, sprite, x = 0, y = 0, *, pal_idx = 0, hflipped = False, v38 = 0):
-		flip_axes_lists = (tuple(), (1,), (0,), (0, 1))
 		hflip_flag = 0x40 if hflipped else 0
 
-		for frame_idx, attribs in enumerate(reversed(sprite.tile_attribs)):
-			tile_y = y + attribs.y
-			tile_x = x + (-attribs.x - 8 if hflipped else attribs.x)
-			sprite_attribs = (attribs.attribs | v38 | pal_idx) ^ hflip_flag
-			tile_idx = sprite.tile_idcs[-1 - frame_idx]
-			
-			tile = chr_bank[tile_idx] + (sprite_attribs & 3) * 4
-			flip_axes = flip_axes_lists[sprite_attribs >> 6]
-			if flip_axes:
-				tile = np.flip(tile, flip_axes)
-
-			tgt = bitmap[tile_y:tile_y+8, tile_x:tile_x+8]
-			ma.choose(tile.mask, (tile, tgt), out = tgt)
+		parts = as_np_array(sprite.tile_attribs, SpriteAttribs)
+		part_xs = parts["x"].astype(np.intp)
+		attribs = (parts["attribs"].astype(np.intp) | v38 | pal_idx) ^ hflip_flag
+
+		blit_metasprite_tiles(
+			bitmap, 
+			chr_bank, 
+			as_np_array(sprite.tile_idcs, c_uint8), 
+			y + parts["y"].astype(np.intp), 
+			x + (-part_xs - 8 if hflipped else part_xs), 
+			attribs, 
+			(attribs & 3) * 4,
+		)
 
 	def get_sprite_type2_bounds(self, sprite):
 		pos = np.array([(part.y, part.x) for part in sprite], dtype = int).transpose()
@@ -969,7 +1271,6 @@ class FireEmblem1Data:
 		return (16 - right, 16 - left_or_x) if right is not None else (16 - left_or_x)
 
 	def draw_sprite_type2(self, bitmap, chr_bank, metasprite, x = 0, y = 0, *, pal_idx = None, hi_pal = False, hflipped = False, pre_set_bits = 0, clear_bits = 0, post_set_bits = 0):
-		flip_axes_lists = (tuple(), (1,), (0,), (0, 1))
 		hflip_flag = 0x40 if hflipped else 0
 		hi_pal = bool(hi_pal) * 0x10
 		
@@ -979,18 +1280,19 @@ class FireEmblem1Data:
 
 		set_bits = post_set_bits | (pre_set_bits & ~clear_bits)
 
-		for part in reversed(metasprite):
-			tile_y = y + part.y
-			tile_x = x + (8 - part.x if hflipped else part.x)
-			attribs = ((part.attribs & ~clear_bits) | set_bits) ^ hflip_flag
-
-			tile = chr_bank[part.tile_idx] + ((attribs & 3) * 4 + hi_pal)
-			flip_axes = flip_axes_lists[attribs >> 6]
-			if flip_axes:
-				tile = np.flip(tile, flip_axes)
-
-			tgt = bitmap[tile_y:tile_y+8, tile_x:tile_x+8]
-			ma.choose(tile.mask, (tile, tgt), out = tgt)
+		parts = as_np_array(metasprite, MetaspriteType2Sprite)
+		part_xs = parts["x"].astype(np.intp)
+		attribs = ((parts["attribs"].astype(np.intp) & ~clear_bits) | set_bits) ^ hflip_flag
+
+		blit_metasprite_tiles(
+			bitmap, 
+			chr_bank, 
+			parts["tile_idx"], 
+			y + parts["y"].astype(np.intp), 
+			x + (8 - part_xs if hflipped else part_xs), 
+			attribs, 
+			(attribs & 3) * 4 + hi_pal,
+		)
 
 	def draw_sprite_frames(
 		self, 
@@ -1039,24 +1341,24 @@ class FireEmblem1Data:
 	def draw_portrait(self, port, *, chr_bank = None, hflipped = False, v38 = 0, v39 = 0):
 		port_size = (64, 64)
 
-		if not chr_bank:
-			chr_bank = self.get_chr_bank_array(port.bank_idx)
+		if chr_bank is None:
+			chr_bank = self.get_chr_bank_atlas(port.bank_idx)
 
 		sprite = self.port_sprites[0][port.sprite_idx]
-		static_bmp = ma.masked_all(port_size, np.uint8)
+		static_bmp = new_bitmap(port_size)
 		self.draw_sprite(static_bmp, chr_bank, sprite)
 		
 		frame_dims = np.zeros((len(port.frame_sprite_idcs) + 1, 2), int)
 		frame_dims[-1] = self.get_sprite_size(sprite)
 
-		bitmap = ma.masked_all((len(port.frame_sprite_idcs),) + port_size, np.uint8)
+		bitmap = new_bitmap((len(port.frame_sprite_idcs),) + port_size)
 		for frame_idx, sprite_idx in enumerate(port.frame_sprite_idcs):
 			sprite = self.port_sprites[0][sprite_idx]
 			frame_dims[frame_idx,:] = self.get_sprite_size(sprite)
 			
 			frame_bmp = bitmap[frame_idx]
 			self.draw_sprite(frame_bmp, chr_bank, sprite)
-			ma.choose(static_bmp.mask, (static_bmp, frame_bmp), out = frame_bmp)
+			blit_bitmap(frame_bmp, static_bmp)
 
 		return bitmap[:, 0:frame_dims[:,1].max(), 0:frame_dims[:,0].max()]
 
@@ -1086,14 +1388,18 @@ class FireEmblem1Data:
 		return self.get_script_addrs()[bank_idx][set_idx][script_idx]
 
 	def get_script(self, bank_idx, set_idx, script_idx):
-		script_iter = self.text.get_script_iter(bank_idx, set_idx, script_idx)
+		script_id = (bank_idx, set_idx, script_idx)
+		script = self._scripts.get(script_id)
+		if script is None:
+			script_iter = self.text.get_script_iter(bank_idx, set_idx, script_idx)
+			script = self._scripts[script_id] = self._get_script(script_iter)
 
 		return ScriptInfo(
 			bank_idx, 
 			set_idx, 
 			script_idx, 
 			self.text.get_script_addrs()[bank_idx][set_idx][script_idx], 
-			*self._get_script(script_iter),
+			*script,
 		)
 
 	def _get_script(self, script_iter):
@@ -1176,4 +1482,91 @@ class FireEmblem1Data:
 		)
 
 		return obj
-		
\ No newline at end of file
+
+# Attributes set by each loader. Any attribute a loader sets must be listed here for it to be loaded on demand.
+FireEmblem1Data._loader_attrs = {
+	FireEmblem1Data._load_chr_tiles: "chr_tiles".split(),
+	FireEmblem1Data._load_map_anim_masks: "map_anim_tile_mask map_anim_metatile_mask".split(),
+	FireEmblem1Data._load_terrain_data: """
+		terrain_img_leca pc_metatile_terrain_types npc_metatile_terrain_types 
+		terrain_dodge_chances terrain_name_idcs unit_terrain_cost_addrs 
+		unit_terrain_costs terrain_img_metasprite_list_addr 
+		terrain_img_metasprite_addrs terrain_img_metasprites
+		terrain_img_metasprites_np
+	""".split(),
+	FireEmblem1Data._load_map_gfx: """
+		map_pal_pack_addrs_addr map_pal_pack_addrs pal_packs metatiles 
+		metatile_arrays metatile_attribs map_anim_banks map_sprite_bank 
+		map_sprite_sprite_idx map_sprite_frame_idcs map_sprite_pal_idcs 
+		map_sprite_right_modes map_sprite_chr_banks map_sprite_tbls_addr 
+		map_sprite_addr_tbls map_sprite_tbls map_sprites
+		map_sprite_tbls_np
+	""".split(),
+	FireEmblem1Data._load_map_data: """
+		map_banks maps map_music_info last_map_music_info
+	""".split(),
+	FireEmblem1Data._load_map_obj_data: """
+		map_obj_leca map_npc_list_addrs map_npc_lists map_pc_list_addrs 
+		map_pc_lists map_start_loc_list_addrs map_start_loc_lists 
+		map_shop_leca map_shop_list_addrs map_shop_lists inv_list_addrs 
+		inv_lists map_dlg_pc_list_addrs map_dlg_pc_lists
+		map_npc_lists_np map_pc_lists_np map_shop_lists_np map_dlg_pc_lists_np
+	""".split(),
+	FireEmblem1Data._load_port_gfx: """
+		port_chr_bank_idcs port_pal_pack_addrs port_pal_idcs port_pal_packs 
+		port_sprite_tbl_addrs port_sprite_addr_tbls port_sprites
+		port_sprites_np
+	""".split(),
+	FireEmblem1Data._load_port_infos: """
+		port_base_sprite_num port_frame_sprite_list_addrs 
+		port_frame_times_list_addrs port_infos
+	""".split(),
+	FireEmblem1Data._load_unit_data: """
+		unit_type_info_addrs unit_type_infos char_growth_info_addrs 
+		char_growth_infos talk_src_pc_ids talk_tgt_npc_ids talk_script_idcs 
+		talk_tgt_new_pc_ids
+		unit_type_infos_np char_growth_infos_np
+	""".split(),
+	FireEmblem1Data._load_item_data: """
+		item_info_leca item_mights item_reqs item_weights item_hit_chances 
+		item_crit_chances item_prices item_uses item_effects item_flags 
+		item_class_equip_none item_class_equip_base item_strong_against_idcs 
+		item_strong_against_tbl_addrs item_strong_against_tbls 
+		item_strong_against_none item_strong_against_base 
+		item_stat_effects_offs item_stat_effects_amounts item_stat_effects_max 
+		stat_effects_base_item_idx stat_item_effects_idcs 
+		item_mamkute_def_bonuses item_mamkute_bonus_base_idx 
+		item_mamkute_bonus_idcs
+	""".split(),
+	FireEmblem1Data._load_battle_gfx: """
+		unit_bsprite_bank_infos unit_bsprite_frame_addrs bsprite_bg_frame_addrs 
+		unit_bsprite_bg_frame_tbl_addrs unit_bsprite_chr_banks 
+		unit_bsprite_init_frame_tbl_addrs unit_bsprite_init_frame_idcs 
+		unit_battle_script_data_addrs unit_battle_script_datas 
+		unit_battle_script_idcs battle_script_addrs battle_scripts 
+		bfx_script_addrs bfx_scripts base_battle_pal_pack_addr 
+		base_battle_pal_pack battle_script_packet_addrs battle_script_packets 
+		battle_unit_spec_frame_idcs battle_flock_anim_x_offs battle_proj_data 
+		battle_proj_y_pos unit_battle_proj_frame_idcs unit_battle_proj_y_offs 
+		unit_battle_proj_chr_bank battle_hit_shake_offs battle_team_hit_pal_idcs 
+		battle_team_unit_pal_idcs battle_mamkute_stone_pal_idcs 
+		battle_pal_row_addrs battle_pal_rows battle_team_death_pal_idcs_addrs 
+		battle_team_death_pal_idcs battle_team_peg_death_pal_idcs 
+		bmov_script_addrs bmov_scripts unit_proj_bmov_script_idx 
+		bpath_script_addrs bpath_scripts banim_script_frame_cnts_addrs 
+		banim_script_frame_cnts banim_script_addrs banim_scripts
+		battle_scripts_np bfx_scripts_np bpath_scripts_np
+	""".split(),
+	FireEmblem1Data._load_text: """
+		miss_info_leca text get_script_addrs translate_text terrain_names 
+		unit_names char_names enemy_names item_names miss_names loc_names 
+		game_strs pre_miss_info_addrs miss_dlg_addrs pre_miss_script_bank_set 
+		miss_dlg_script_bank_set item_class_equip_idcs 
+		item_class_equip_tbl_addrs item_class_equip_tbls
+	""".split(),
+}
+FireEmblem1Data._lazy_attrs = {
+	name: loader
+	for loader, names in FireEmblem1Data._loader_attrs.items()
+	for name in names
+}
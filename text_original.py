@@ -33,8 +33,8 @@ for _base_idx, _chars in (
 _char_set.update(((ch, f"\\x{ch:02x}") for ch in (set(range(256)) - _char_set.keys())))
 
 class TextData(TextDataBase):
-	def __init__(self, rom, chr_start_offs):
-		super().__init__(rom, chr_start_offs)
+	def __init__(self, rom, chr_start_offs, *, term_index = None):
+		super().__init__(rom, chr_start_offs, term_index = term_index)
 
 		leca = get_leca4((6, 15))
 		self.item_class_equip_part_tbl = (c_uint8 * 9).from_buffer(rom, leca(0xa3d1))
@@ -54,6 +54,7 @@ class TextData(TextDataBase):
 			9, 
 			terms = 0xef, 
 			end_offs = chr_start_offs,
+			term_index = self._term_index,
 		)
 
 	def get_script_iter(self, bank_idx, set_idx, script_idx):
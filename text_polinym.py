@@ -98,8 +98,8 @@ class _ScriptInnerIterator:
 		return (c_char * text_len).from_buffer(rom, abs_offs)
 
 class TextData(TextDataBase):
-	def __init__(self, rom, chr_start_offs):
-		super().__init__(rom, chr_start_offs)
+	def __init__(self, rom, chr_start_offs, *, term_index = None):
+		super().__init__(rom, chr_start_offs, term_index = term_index)
 
 		dict_pos = ((0, 0xb5a0, 0x80), (8, 0xdea0, 0xc7))
 		self._dicts = []
@@ -119,6 +119,7 @@ class TextData(TextDataBase):
 			12, 
 			terms = 0xef, 
 			end_offs = chr_start_offs,
+			term_index = self._term_index,
 		)
 
 		return